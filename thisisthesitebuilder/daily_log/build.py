@@ -2,7 +2,8 @@ import os
 from thisisthebus.settings.constants import DATA_DIR
 
 from markdown import markdown
-import yaml
+
+from thisisthesitebuilder.utils.yaml_loader import load_yaml_file, yaml_cache_dir
 
 def process_summaries():
     print("Processing Summaries.")
@@ -14,10 +15,9 @@ def process_summaries():
     for counter, yaml_file in enumerate(summary_files):
         month = yaml_file.rstrip(".yaml")
 
-        with open("%s/%s" % (summaries_dir, yaml_file), 'r') as f:
-            month_yaml = yaml.load(f.read())
-            for day, summary in month_yaml.items():
-                day_string = str(day).zfill(2)
-                summaries["%s-%s" % (month, day_string)] = markdown(summary)
+        month_yaml = load_yaml_file("%s/%s" % (summaries_dir, yaml_file), cache_dir=yaml_cache_dir(DATA_DIR))
+        for day, summary in month_yaml.items():
+            day_string = str(day).zfill(2)
+            summaries["%s-%s" % (month, day_string)] = markdown(summary)
 
     return summaries
\ No newline at end of file
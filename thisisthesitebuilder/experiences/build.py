@@ -1,28 +1,80 @@
 import datetime
+import multiprocessing
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-import maya
+from thisisthesitebuilder.experiences.models import Experience, Era, experiences_index
+from thisisthesitebuilder.pages.parsers import configure_parse_cache_for_build, parse_markdown_and_django_template
+from thisisthesitebuilder.pages.templates import templates_fingerprint
+from thisisthesitebuilder.utils.timeline import IntervalIndex
+from thisisthesitebuilder.utils.yaml_loader import load_yaml_file, yaml_cache_dir
 
-from thisisthesitebuilder.experiences.models import Experience, Era
-from thisisthesitebuilder.pages.parsers import parse_markdown_and_django_template
-from thisisthesitebuilder.utils.yaml_loader import yaml_ordered_load
+
+DirectoryTree = namedtuple('DirectoryTree', ('path', 'dirs', 'files'))
+
+
+def scan_tree(path):
+    """
+    Lists a directory and everything beneath it, visiting each directory exactly once.
+    """
+    dirs = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                dirs.append(scan_tree(entry.path))
+            else:
+                files.append(entry.name)
+    return DirectoryTree(path, dirs, files)
+
+
+def tree_filenames(tree):
+    filenames = [tree.path + "/" + filename for filename in tree.files]
+    for subtree in tree.dirs:
+        filenames += tree_filenames(subtree)
+    return filenames
+
+
+def read_era_meta(yaml_filename, cache_dir=None):
+    experience_dict = load_yaml_file(yaml_filename, ordered=True, cache_dir=cache_dir)
+
+    experience_dict['description'] = parse_markdown_and_django_template(experience_dict['description'])
+    return experience_dict
 
 
 class EraBuilder(object):
 
-    def __init__(self, build_meta, summaries, locations, images, places):
+    def __init__(self, build_meta, summaries, locations, images, places, processes=None):
         self.build_meta = build_meta
         self.summaries = summaries
         self.locations = locations
         self.images = images
         self.places = places
+        self.processes = processes
+        self._preloaded_meta = {}
 
-    def era_meta_from_yaml(self, yaml_filename):
-        with open(yaml_filename, 'r') as f:
-            experience_dict = yaml_ordered_load(f.read())
+        configure_parse_cache_for_build(build_meta, templates_fingerprint())
 
-        experience_dict['description'] = parse_markdown_and_django_template(experience_dict['description'])
-        return experience_dict
+    def preload_meta(self, yaml_filenames):
+        """
+        Parses YAML files, and renders their descriptions, across a pool of worker processes.
+
+        The workers are forked, so they render with the same templates and data as we would.
+        """
+        pending = [filename for filename in yaml_filenames if filename not in self._preloaded_meta]
+        if len(pending) < 2 or self.processes == 1:
+            return
+        cache_dirs = [yaml_cache_dir(self.build_meta['data_dir'])] * len(pending)
+        # Forked explicitly: spawned workers would have neither Django's settings nor the loaded data.
+        with ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('fork')) as executor:
+            self._preloaded_meta.update(zip(pending, executor.map(read_era_meta, pending, cache_dirs, chunksize=4)))
+
+    def era_meta_from_yaml(self, yaml_filename):
+        try:
+            return self._preloaded_meta.pop(yaml_filename)
+        except KeyError:
+            return read_era_meta(yaml_filename, yaml_cache_dir(self.build_meta['data_dir']))
 
     def era_from_yaml(self, yaml_filename, build_meta):
         era_dict = self.era_meta_from_yaml(yaml_filename)
@@ -33,6 +85,7 @@ class EraBuilder(object):
             slug = right_most
 
         era = Era(slug=slug, build_meta=build_meta, **era_dict)
+        era.yaml_filename = yaml_filename
 
         return era
 
@@ -46,58 +99,63 @@ class EraBuilder(object):
             slug = right_most
 
         experience = Experience(slug=slug, build_meta=self.build_meta, **experience_dict)
+        experience.yaml_filename = yaml_filename
 
         experience.start_day = experience.start.date()
 
         if not experience.end:
             experience.end = datetime.datetime.now()
+            experience.ongoing = True
 
         try:
             experience.end_day = experience.end.date()
         except:
             pass
 
-        experience.start_maya = maya.MayaDT.from_datetime(experience.start)
-        experience.end_maya = maya.MayaDT.from_datetime(experience.end)
+        experience.set_span()
         return experience
 
-    def build_eras(self, eras_dir, experiences=()):
+    def build_eras(self, eras_dir, experiences=(), tree=None):
         """
         TODO: Dehydrate with build_experiences
         """
-        eras_dir_listing = list(os.walk(eras_dir))
-        era_dirs = eras_dir_listing[0][1]
-        era_files = eras_dir_listing[0][2]
+        if not isinstance(experiences, IntervalIndex):
+            experiences = experiences_index(experiences)
+
+        if tree is None:
+            tree = scan_tree(eras_dir)
+            self.preload_meta(tree_filenames(tree))
 
         eras = []
 
-        for era_dir in era_dirs:
-            era = self.build_eras(eras_dir + "/" + era_dir)[0]
+        for subtree in tree.dirs:
+            era = self.build_eras(subtree.path, experiences, subtree)[0]
             eras.append(era)
 
-        for era_file in era_files:
+        for era_file in tree.files:
             era = self.era_from_yaml(eras_dir + "/" + era_file, self.build_meta)
             era.absorb_happenings()
             era.find_intersecting(experiences)
+            era.roll_up()
             eras.append(era)
 
-        return sorted(eras, key=lambda e: e.start_maya, reverse=True)
+        return sorted(eras, key=lambda e: e.start_epoch, reverse=True)
 
-    def build_experiences(self, experiences_dir):
+    def build_experiences(self, experiences_dir, tree=None):
 
-        experience_dir_listing = list(os.walk(experiences_dir))
-        experience_dirs = experience_dir_listing[0][1]
-        experience_files = experience_dir_listing[0][2]
+        if tree is None:
+            tree = scan_tree(experiences_dir)
+            self.preload_meta(tree_filenames(tree))
 
         top_level_experiences = []
         sub_experiences = []
 
-        for experience_dir in experience_dirs:
-            top_level_experience = self.build_experiences(experiences_dir + "/" + experience_dir)[0]
+        for subtree in tree.dirs:
+            top_level_experience = self.build_experiences(subtree.path, subtree)[0]
             top_level_experiences.append(top_level_experience)
 
         has_subs = False
-        for experience_file in experience_files:
+        for experience_file in tree.files:
             experience = self.experience_from_yaml(experiences_dir + "/" + experience_file)
             if experience_file == "main.yaml":
                 has_subs = True
@@ -111,7 +169,7 @@ class EraBuilder(object):
                 sub.absorb_happenings()
                 top_level_experiences.append(sub)
 
-        sub_experiences.sort(key=lambda e: e.start_maya)
+        sub_experiences.sort(key=lambda e: e.start_epoch)
 
         if has_subs:
             for sub_experience in sub_experiences:
@@ -120,5 +178,11 @@ class EraBuilder(object):
             top_level_experience.absorb_happenings()
         for sub in sub_experiences:
             sub.apply_locations()
+
+        if has_subs:
+            top_level_experience.roll_up()
+        else:
+            for sub in sub_experiences:
+                sub.roll_up()
         print("Built from {}".format(experiences_dir))
-        return sorted(top_level_experiences, key=lambda e: e.start_maya, reverse=True)
+        return sorted(top_level_experiences, key=lambda e: e.start_epoch, reverse=True)
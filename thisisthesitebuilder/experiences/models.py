@@ -1,13 +1,54 @@
 import hashlib
 import json
+from collections import namedtuple
 
 import maya
 from build.built_fundamentals import SUMMARIES, LOCATIONS, INTERTWINED_MEDIA
 from django.db import models
-from thisisthebus.settings.constants import TIMEZONE_UTC_OFFSET
 
 from thisisthesitebuilder.images.models import Image, Clip
-from thisisthesitebuilder.utils.datetime_formatting import month_day_maybe_year
+from thisisthesitebuilder.utils.datetime_formatting import epoch_of, month_day_maybe_year
+from thisisthesitebuilder.utils.dependencies import Dependencies, authored_path
+from thisisthesitebuilder.utils.fingerprint import combined_fingerprint
+from thisisthesitebuilder.utils.timeline import IntervalIndex, Timeline
+
+_timelines = {}
+
+Rollup = namedtuple('Rollup', ('image_count', 'clip_count', 'places', 'locations', 'location_count',
+                               'first_media_time', 'last_media_time'))
+
+
+def locations_timeline():
+    """
+    Every location in LOCATIONS, indexed by time.  Built once and shared by every Era.
+    """
+    try:
+        return _timelines['locations']
+    except KeyError:
+        timeline = _timelines['locations'] = Timeline(
+            (location.epoch(), location)
+            for locations_for_day in LOCATIONS.values()
+            for location in locations_for_day.values())
+        return timeline
+
+
+def summaries_timeline():
+    """
+    Every (day, summary) in SUMMARIES, indexed by the day's time.  Built once and shared by every Experience.
+    """
+    try:
+        return _timelines['summaries']
+    except KeyError:
+        timeline = _timelines['summaries'] = Timeline(
+            (epoch_of(day), (day, summary)) for day, summary in SUMMARIES.items())
+        return timeline
+
+
+def experiences_index(experiences):
+    """
+    An IntervalIndex of experiences over their start and end epochs.
+    """
+    return IntervalIndex((experience.start_epoch, experience.end_epoch, experience) for experience in experiences)
 
 
 class Era(models.Model):
@@ -35,15 +76,28 @@ class Era(models.Model):
         self.all_locations = []
 
         self._has_absorbed_happenings = False
+        self._location_aggregations = {}
+        self.rollup = None
+        self.yaml_filename = None
+        # Whether this has no end of its own, and so ends whenever it's built.
+        self.ongoing = False
 
         super(Era, self).__init__(*args, **kwargs)
 
-        self.start_maya = maya.MayaDT.from_datetime(self.start)
-        self.end_maya = maya.MayaDT.from_datetime(self.end)
+        self.set_span()
 
     def __str__(self):
         return self.name
 
+    def set_span(self):
+        """
+        Derives the maya datetimes (for presentation) and integer epochs (for comparison) from start and end.
+        """
+        self.start_maya = maya.MayaDT.from_datetime(self.start)
+        self.end_maya = maya.MayaDT.from_datetime(self.end)
+        self.start_epoch = self.start_maya.epoch
+        self.end_epoch = self.end_maya.epoch
+
     def absorb_happenings(self):
         """
         Figure out everything that happened during this experience and populate it with the appropriate metadata.
@@ -57,6 +111,7 @@ class Era(models.Model):
         self.text_checksum = hashlib.md5(
             self.description.encode() + self.summary.encode()).hexdigest()
         self._has_absorbed_happenings = True
+        self._forget_fingerprint()
 
         if self.persist:
             try:
@@ -103,32 +158,129 @@ class Era(models.Model):
                 self.has_changed = False
                 self.previous_meta = experience_meta_json
 
+    def content_dependencies(self):
+        """
+        The authored files this Era read - its own YAML and those of the places it visited - the span of time
+        whose day files it read (open-ended if it's ongoing) and its dates as displayed, along with those of
+        its sub-experiences.
+        """
+        inputs = {"places/%s" % location.place.slug for location in self.all_locations}
+        if self.yaml_filename:
+            inputs.add(authored_path(self.build_meta['data_dir'], self.yaml_filename))
+        span = self.start_epoch, None if self.ongoing else self.end_epoch
+        own_dependencies = Dependencies(inputs, span, displayed=(self.start_date(), self.end_date()))
+        return Dependencies.combine(
+            own_dependencies, *[sub_experience.content_dependencies() for sub_experience in self.sub_experiences])
+
+    def dependencies(self):
+        """
+        Everything a page showing this Era depends on: its content_dependencies, and those of the experiences
+        it intersects, whose names, descriptions and places it shows too.
+        """
+        try:
+            intersecting = self._intersection
+        except AttributeError:
+            intersecting = []
+        return Dependencies.combine(self.content_dependencies(),
+                                    *[experience.content_dependencies() for experience in intersecting])
+
+    def roll_up(self):
+        """
+        Aggregates media counts, places, locations and the span of media over this Era and (first) its
+        sub-experiences, so templates needn't walk the tree.  Call once happenings have been applied throughout.
+        """
+        for sub_experience in self.sub_experiences:
+            sub_experience.roll_up()
+        sub_rollups = [sub_experience.rollup for sub_experience in self.sub_experiences]
+
+        image_count = sum(1 for media in self.images if media.__class__ == Image)
+        clip_count = sum(1 for media in self.images if media.__class__ == Clip)
+        locations = set(self.all_locations)
+        media_times = [media.date_and_time() for media in self.images]
+
+        for sub_rollup in sub_rollups:
+            image_count += sub_rollup.image_count
+            clip_count += sub_rollup.clip_count
+            locations.update(sub_rollup.locations)
+            if sub_rollup.first_media_time:
+                media_times += [sub_rollup.first_media_time, sub_rollup.last_media_time]
+
+        self.rollup = Rollup(
+            image_count=image_count,
+            clip_count=clip_count,
+            places=frozenset(location.place for location in locations),
+            locations=frozenset(locations),
+            location_count=len(locations),
+            first_media_time=min(media_times) if media_times else None,
+            last_media_time=max(media_times) if media_times else None,
+        )
+        self._forget_fingerprint()
+        return self.rollup
+
+    def content_fingerprint(self):
+        """
+        A hash of everything about this Era itself that its pages can show: its authored fields, its dates as
+        displayed, its media, locations and summaries, and its sub-experiences.
+
+        Cached until any of those are applied again.
+        """
+        try:
+            return self._content_fingerprint
+        except AttributeError:
+            # Experiences that haven't ended end now, so it's the displayed dates that count, not the datetimes.
+            fields = [(field.attname, getattr(self, field.attname)) for field in self._meta.concrete_fields
+                      if field.attname not in ('start', 'end')]
+            self._content_fingerprint = combined_fingerprint(
+                self.__class__.__name__, fields, self.start_date(), self.end_date(), self.tags, self.sections,
+                self.sub_experiences, self.images, self.specific_locations, self.all_locations,
+                getattr(self, 'summaries', None))
+            return self._content_fingerprint
+
+    def fingerprint(self):
+        """
+        The content_fingerprint of this Era and of each experience it intersects, whose names, descriptions
+        and places its pages show.  (Just their content: experiences intersect each other.)
+        """
+        try:
+            return self._fingerprint
+        except AttributeError:
+            try:
+                intersecting = [experience.content_fingerprint() for experience in self._intersection]
+            except AttributeError:
+                intersecting = None
+            self._fingerprint = combined_fingerprint(self.content_fingerprint(), intersecting)
+            return self._fingerprint
+
+    def _forget_fingerprint(self):
+        for attribute in ('_fingerprint', '_content_fingerprint'):
+            try:
+                delattr(self, attribute)
+            except AttributeError:
+                pass
+
     def last_updated(self):
         return maya.MayaDT.from_iso8601(self.previous_meta['datetime'])
 
     def apply_locations(self):
-        for filename, locations_for_day in LOCATIONS.items():
-            day = filename.rstrip('.yaml')
-            for time, location in locations_for_day.items():
-                try:
-                    location_maya = maya.parse(day + "T" + time)
-                except TypeError:
-                    raise ("Had trouble parsing date or time in %s" % filename)
-                if self.start_maya <= location_maya <= self.end_maya:
-                    self.all_locations.append(location)
-                    # The dates match - now let's make sure that, if this is a top-level experience, that this place can be listed on it.
-                    can_be_listed = not self.sub_experiences or location.place.show_on_top_level_experience
-                    if can_be_listed:
-                        self.add_location(location)
+        for location in locations_timeline().between(self.start_epoch, self.end_epoch):
+            self.all_locations.append(location)
+            # The dates match - now let's make sure that, if this is a top-level experience, that this place can be listed on it.
+            can_be_listed = not self.sub_experiences or location.place.show_on_top_level_experience
+            if can_be_listed:
+                self.add_location(location)
 
         self.specific_locations.sort(key=lambda l: str(l))
         self.all_locations.sort(key=lambda l: str(l))
+        self._location_aggregations = {}
+        self._forget_fingerprint()
 
         distinguisher = str([str(l) for l in self.all_locations]).encode()
         return hashlib.md5(distinguisher).hexdigest()
 
     def add_location(self, location):
         self.specific_locations.append(location)
+        self._location_aggregations = {}
+        self._forget_fingerprint()
 
     def intersection(self):
         try:
@@ -136,77 +288,65 @@ class Era(models.Model):
         except AttributeError:
             raise TypeError("You need to find_intersecting experiences first.")
 
-        return sorted(intersecting, key=lambda e: e.start_maya)
+        return list(intersecting)
 
     def find_intersecting(self, experiences):
         """
-        Takes a list of experiences.
-        Sets the attribute, intersecting, which is a list of experiences which start or end within this one.
+        Takes a list of experiences, or an experiences_index of them.
+        Sets the attribute, intersecting, which is a list of experiences which overlap this one at all -
+        starting within it, ending within it, or spanning it - ordered by start.
         """
-        self._intersection = []
-        for experience in experiences:
-            begins_within = self.start_maya < experience.start_maya < self.end_maya
-            ends_within = self.start_maya < experience.end_maya < self.end_maya
+        if not isinstance(experiences, IntervalIndex):
+            experiences = experiences_index(experiences)
+        self._intersection = experiences.overlapping(self.start_epoch, self.end_epoch)
+        self._forget_fingerprint()
 
-            if begins_within or ends_within:
-                self._intersection.append(experience)
+    def _aggregate_locations(self, key, aggregate):
+        """
+        Memoizes aggregations over this Era's locations until its locations change.
+        """
+        try:
+            result = self._location_aggregations[key]
+        except KeyError:
+            result = self._location_aggregations[key] = aggregate()
+        return list(result)
 
     def places(self, reverse_order=False):
-        locations = sorted(list(set(self.all_locations)), key=lambda l: l.__str__(),
-                           reverse=reverse_order)
-        places = []
-        for location in locations:
-            if location.place not in places:
-                places.append(location.place)
-        return places
+        def aggregate():
+            locations = sorted(set(self.all_locations), key=lambda l: l.__str__(), reverse=reverse_order)
+            return list(dict.fromkeys(location.place for location in locations))
+        return self._aggregate_locations(("places", reverse_order), aggregate)
 
     def unique_locations_by_place(self):
         """
         Does *not* include sub-experiences.
         """
-        seen_places = []
-        unique_locations = []
-        for location in self.specific_locations:
-            if not location.place in seen_places:
-                unique_locations.append(location)
-            seen_places.append(location.place)
-        return unique_locations
+        def aggregate():
+            seen_places = set()
+            unique_locations = []
+            for location in self.specific_locations:
+                if location.place not in seen_places:
+                    unique_locations.append(location)
+                    seen_places.add(location.place)
+            return unique_locations
+        return self._aggregate_locations(("by_place",), aggregate)
 
     def unique_locations_by_field(self, field, reverse_order=False):
         """
         *Includes* sub-experiences.
-        """
-
-        seen_values = []
-        unique_values_and_locations = {}
-        familiar_values_and_locations = {}
-
-        for location in self.all_locations:
-            place = location.place
-            value = place.__dict__[field]
-
-            if value in seen_values:
-                places_with_this_value = familiar_values_and_locations.setdefault(value, [])
-                seen_location = unique_values_and_locations.pop(value, None)
-
-                if seen_location:
-                    places_with_this_value.append(seen_location)
 
-                places_with_this_value.append(location)
-            else:
-                unique_values_and_locations[value] = location
-            seen_values.append(value)
-
-        unique_place_locations = list(unique_values_and_locations.values())
+        Groups locations by the value of field on their place, and keeps the most significant location of each group.
+        """
+        def aggregate():
+            locations_by_value = {}
+            for location in self.all_locations:
+                locations_by_value.setdefault(location.place.__dict__[field], []).append(location)
 
-        for value, location_list in familiar_values_and_locations.items():
-            most_significant_location = max(location_list, key=lambda l: l.significance())
-            unique_place_locations.append(most_significant_location)
+            unique_place_locations = [
+                max(location_list, key=lambda l: l.significance()) for location_list in locations_by_value.values()]
 
-        unique_place_locations = sorted(list(set(unique_place_locations)),
-                                        key=lambda l: l.__str__(),
-                                        reverse=reverse_order)
-        return unique_place_locations
+            return sorted(set(unique_place_locations), key=lambda l: l.__str__(), reverse=reverse_order)
+        return self._aggregate_locations(("by_field", field, reverse_order), aggregate)
 
     def unique_places_by_field(self, field):
         unique_place_locations = self.unique_locations_by_field(field)
@@ -310,6 +450,12 @@ class Eras(list):
         except IndexError:
             return None, None
 
+    def fingerprint(self):
+        """
+        Not cached, since groups are still being filled in as Eras are added; the Eras themselves are.
+        """
+        return combined_fingerprint(self.page_name, list(self))
+
 
 class Experience(Era):
     display = models.CharField(max_length=30)
@@ -318,35 +464,40 @@ class Experience(Era):
 
     def apply_images(self):
 
-        for day, image_list in INTERTWINED_MEDIA.by_date().items():
-            for image in image_list:
-                image_maya = maya.parse(day + "T" + image.time + TIMEZONE_UTC_OFFSET)
-                if self.start_maya < image_maya < self.end_maya:
-                    self._all_images_including_subs.append(image)
-                    image.is_used = True
-                    applied_to_sub = False
-                    for sub_experience in self.sub_experiences:
-                        for tag in sub_experience.tags:
-                            if tag in image.tags:
-                                sub_experience.images.append(image)
-                                applied_to_sub = True
-                    if not applied_to_sub:
-                        self.images.append(image)
+        # Which media in our window each sub-experience claims, by way of the tag index.
+        sub_experience_media = []
+        for sub_experience in self.sub_experiences:
+            claimed = set()
+            for tag in sub_experience.tags:
+                claimed.update(id(image) for image in INTERTWINED_MEDIA.tagged(tag, self.start_epoch, self.end_epoch))
+            if claimed:
+                sub_experience_media.append((sub_experience, claimed))
+
+        for image in INTERTWINED_MEDIA.range(self.start_epoch, self.end_epoch):
+            self._all_images_including_subs.append(image)
+            image.is_used = True
+            applied_to_sub = False
+            for sub_experience, claimed in sub_experience_media:
+                if id(image) in claimed:
+                    sub_experience.images.append(image)
+                    sub_experience._forget_fingerprint()
+                    applied_to_sub = True
+            if not applied_to_sub:
+                self.images.append(image)
 
         return hashlib.md5(
             str([i.distinguisher() for i in self._all_images_including_subs]).encode()).hexdigest()
 
     def apply_summaries(self):
         # summaries
-        self.summaries = {}
-        for day, summary in SUMMARIES.items():
-            summary_maya = maya.parse(day)
-            if self.start_maya < summary_maya and summary_maya < self.end_maya:
-                self.summaries[day] = summary
+        self.summaries = dict(summaries_timeline().between(self.start_epoch, self.end_epoch, inclusive=False))
 
         return hashlib.md5(str(self.summaries).encode()).hexdigest()
 
     def media_count(self):
+        if self.rollup is not None:
+            return self.rollup.image_count, self.rollup.clip_count
+
         image_count = 0
         clip_count = 0
         for e in self.sub_experiences:
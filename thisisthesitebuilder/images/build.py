@@ -1,9 +1,10 @@
-import os
-
-
+import bisect
+import heapq
 import json
+import os
 from collections import OrderedDict
 from .models import Image
+from thisisthesitebuilder.utils.fingerprint import combined_fingerprint
 
 
 class MultimediaCollection(object):
@@ -15,8 +16,17 @@ class MultimediaCollection(object):
         self._by_date = {}
         self.by_slug = {}
         self.by_distinguisher = {}
+        self.by_tag = {}
         self._as_list = []
 
+        # Sorted views, built on demand and thrown away whenever a media object is included.
+        self._sorted_list = None
+        self._sorted_by_date = None
+        self._by_epoch = None
+        self._epochs = None
+        self._sorted_by_tag = {}
+        self._fingerprint = None
+
         self.non_unique_distinguishers = []
         self.non_unique_slugs = []
         self.count = 0
@@ -28,26 +38,50 @@ class MultimediaCollection(object):
     def __str__(self):
         return "{types} collection - {count}".format(types=self.media_types(), count=self.count)
 
+    def fingerprint(self):
+        """
+        A hash of every media object in the collection, in order.  Thrown away whenever one is included.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = combined_fingerprint(sorted(self.media_types()), list(self))
+        return self._fingerprint
+
     def __iter__(self):
-        return iter(sorted(self._as_list, key=lambda m: m.date_and_time()))
+        if self._sorted_list is None:
+            self._sorted_list = sorted(self._as_list, key=lambda m: m.date_and_time())
+        return iter(self._sorted_list)
 
     def __next__(self):
         raise RuntimeError()
 
     @classmethod
     def intertwine(cls, *media_collections):
+        """
+        Merges collections into one.
+
+        Each collection already iterates in time order, so they're merged in a single pass, and the
+        merged list and every day within it come out sorted without sorting anything again.
+        """
         intertwined = cls()
 
-        for media_collection in media_collections:
-            for media_object in media_collection:
-                intertwined.include_media_object(media_object)
+        for media_object in heapq.merge(*media_collections, key=lambda m: m.date_and_time()):
+            intertwined._index_media_object(media_object)
+
+        intertwined._sorted_list = intertwined._as_list
 
         return intertwined
 
     def media_types(self):
         return [cls.__name__ for cls in self.media_classes]
 
-    def include_media_object(self, media_object):
+    def _index_media_object(self, media_object):
+        self._fingerprint = None
+        self._sorted_list = None
+        self._sorted_by_date = None
+        self._by_epoch = None
+        self._epochs = None
+        self._sorted_by_tag = {}
+
         self._as_list.append(media_object)
         day_media_objects = self._by_date.setdefault(media_object.date, [])
 
@@ -65,8 +99,27 @@ class MultimediaCollection(object):
         else:
             self.non_unique_slugs.append(slug)
 
+        for tag in set(media_object.tags):
+            self.by_tag.setdefault(tag, []).append(media_object)
+
+        return day_media_objects
+
+    def include_media_object(self, media_object):
+        day_media_objects = self._index_media_object(media_object)
         day_media_objects.sort(key=lambda i: i.time)
 
+    def include_media_objects(self, media_objects):
+        """
+        Bulk version of include_media_object: indexes everything first, then sorts each affected day once.
+        """
+        affected_days = set()
+        for media_object in media_objects:
+            self._index_media_object(media_object)
+            affected_days.add(media_object.date)
+
+        for day in affected_days:
+            self._by_date[day].sort(key=lambda i: i.time)
+
     def walk_files(self, data_dir, multimedia_class):
         self.media_classes.add(multimedia_class)
         for metadata_file in os.listdir(data_dir):
@@ -80,6 +133,7 @@ class MultimediaCollection(object):
                         file=metadata_file, message=e)
                     raise ValueError(error_message)
                 # Populate a list for the media objects for this day.
+                media_objects = []
 
                 for metadata in metadata_for_this_day:
                     try:
@@ -87,12 +141,46 @@ class MultimediaCollection(object):
                     except TypeError:
                         raise TypeError("Can't make a {media_type} from {metadata}".format(media_type=self.MultimediaClass, metadata=metadata))
 
-                    self.include_media_object(media_object)
+                    media_objects.append(media_object)
+
+                self.include_media_objects(media_objects)
 
         print("Processed {} {} objects from {}".format(len(self._as_list), multimedia_class.__name__, data_dir))
 
     def by_date(self):
-        return OrderedDict(sorted(self._by_date.items(), key=lambda iotd: iotd[0]))
+        if self._sorted_by_date is None:
+            self._sorted_by_date = OrderedDict(sorted(self._by_date.items(), key=lambda iotd: iotd[0]))
+        return self._sorted_by_date
+
+    def range(self, start, end):
+        """
+        Takes two epochs and returns the media objects strictly between them, in time order.
+        """
+        if self._epochs is None:
+            # Sorted by epoch, not by date_and_time(): times that aren't zero-padded don't sort as strings.
+            self._by_epoch = sorted(self, key=lambda m: m.epoch())
+            self._epochs = [media_object.epoch() for media_object in self._by_epoch]
+        first = bisect.bisect_right(self._epochs, start)
+        last = bisect.bisect_left(self._epochs, end)
+        return self._by_epoch[first:last]
+
+    def tags(self):
+        return sorted(self.by_tag)
+
+    def tagged(self, tag, start=None, end=None):
+        """
+        Media objects with tag, in time order; optionally only those strictly between the epochs start and end.
+        """
+        try:
+            epochs, media_objects = self._sorted_by_tag[tag]
+        except KeyError:
+            media_objects = sorted(self.by_tag.get(tag, ()), key=lambda m: m.epoch())
+            epochs = [media_object.epoch() for media_object in media_objects]
+            self._sorted_by_tag[tag] = epochs, media_objects
+
+        first = 0 if start is None else bisect.bisect_right(epochs, start)
+        last = len(epochs) if end is None else bisect.bisect_left(epochs, end)
+        return media_objects[first:last]
 
     def lookup_by_distinguisher(self, distinguisher):
         if not hash in self.non_unique_distinguishers:
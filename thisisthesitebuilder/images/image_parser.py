@@ -1,16 +1,33 @@
+import csv
 import datetime
 import json
+import multiprocessing
+import os
+import re
 import shutil
 import subprocess
 import sys
-import hashlib
+from collections import OrderedDict
+from time import perf_counter
 
+import yaml
 from PIL import Image, ExifTags
 from django.utils.text import slugify
 
+from thisisthesitebuilder.images.transcode_queue import TranscodeQueue
+from thisisthesitebuilder.images.transcoding import FULL, THUMB
+from thisisthesitebuilder.utils.hashing import HashCache, file_hash
+
 MAX_SIZE = 1600.0
 THUMB_SIZE = 400
 
+# Reduce by an integer factor only while the result stays this many times larger than the target,
+# so the final Lanczos pass still has enough pixels to work with.
+REDUCING_GAP = 2.0
+
+MANIFEST_DAY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+MANIFEST_TIME = re.compile(r"^(\d{2}):(\d{2})(:\d{2})?$")
+
 
 def autorotate(image_file, orientation):
     if orientation == 3:
@@ -108,26 +125,13 @@ def write_to_file(filename, payload):
         print("-----------------------------------")
 
 
-def calculate_resize(w, h):
-    full_resize_ratio = min(MAX_SIZE / w, MAX_SIZE / h)
-    full_resize_ratio = min(full_resize_ratio, 1)
-
-    thumb_resize_ratio = min(THUMB_SIZE / w, THUMB_SIZE / h)
-    thumb_resize_ratio = min(thumb_resize_ratio, 1)
-
-    full_size = h * full_resize_ratio, w * full_resize_ratio
-    thumb_size = h * thumb_resize_ratio, w * thumb_resize_ratio
-    return full_size, thumb_size
-
-
 def parse_video(video_filename, data_dir, frontend_dir):
     result = subprocess.run(["ffprobe", "-print_format", "json", "-show_format", "-show_streams", video_filename], stdout=subprocess.PIPE)
     video_info = json.loads(result.stdout.decode('utf-8'))
 
-    with open(video_filename, "rb") as f:
-        f.seek(16384)
-        video_bytes = f.read(2048)
-        video_checksum = hashlib.md5(video_bytes).hexdigest()[:8]
+    hash_cache = HashCache.for_data_dir(data_dir)
+    video_checksum = hash_cache.hash(video_filename)
+    hash_cache.save()
 
     creation_dt = None
 
@@ -181,58 +185,6 @@ def parse_video(video_filename, data_dir, frontend_dir):
     full_filename = '/apps/multimedia/Clip/full/%s.webm' % (file_detail)
     thumb_filename = '/apps/multimedia/Clip/thumbs/%s.webm' % (file_detail)
 
-    thumb_duration = duration
-
-    try:
-        if int(duration) > 10:
-            print("Duration was %s; setting to 10 for thumb." % duration)
-            thumb_duration = "10"
-    except TypeError:
-        print("Wasn't able to cast %s to int to test for thumb duration." % duration)
-
-
-    thumb_pass_1_args = [
-        "ffmpeg", "-y", "-ss", start_time, "-t", thumb_duration, "-i", video_filename, "-maxrate", "80000", "-c:v",
-        "libvpx-vp9", "-pass", "1", "-b:v", "1000K", "-threads", "1", "-speed", "4", "-tile-columns", "0",
-        "-frame-parallel", "0", "-auto-alt-ref", "1", "-lag-in-frames", "25", "-g", "9999",
-        "-aq-mode", "0", "-f", "webm", "-vf",
-        "scale=256:-1", "-an", "/dev/null"]
-
-    thumb_pass_2_args = [
-        "ffmpeg", "-y", "-ss", start_time, "-t", thumb_duration, "-i", video_filename, "-maxrate", "80000", "-c:v",
-        "libvpx-vp9", "-pass", "2", "-b:v", "1000K", "-threads", "1", "-speed", "0", "-tile-columns", "0",
-        "-frame-parallel", "0", "-auto-alt-ref", "1", "-lag-in-frames", "25", "-g", "9999",
-        "-aq-mode", "0", "-c:a", "libopus", "-b:a", "64k", "-f", "webm", "-vf",
-        "scale=256:-1", "-an", frontend_dir + thumb_filename]
-
-    full_pass_1_args = [
-        "ffmpeg", "-y", "-ss", start_time, "-t", duration, "-i", video_filename, "-maxrate",
-        "335000", "-c:v",
-        "libvpx-vp9", "-pass", "1", "-b:v", "1000K", "-threads", "1", "-speed", "4",
-        "-tile-columns", "0",
-        "-frame-parallel", "0", "-auto-alt-ref", "1", "-lag-in-frames", "25", "-g", "9999",
-        "-aq-mode", "0", "-f", "webm",
-        "/dev/null"]
-
-    full_pass_2_args = ["ffmpeg", "-y", "-ss", start_time, "-t", duration, "-i", video_filename, "-maxrate",
-        "335000", "-c:v",
-        "libvpx-vp9", "-pass", "2", "-b:v", "1000K", "-threads", "1", "-speed", "0",
-        "-tile-columns", "0",
-        "-frame-parallel", "0", "-auto-alt-ref", "1", "-lag-in-frames", "25", "-g", "9999",
-        "-aq-mode", "0", "-c:a", "libopus", "-b:a", "64k", "-f",
-        "webm",
-        frontend_dir + full_filename]
-
-    if audio == "N":
-        for arg_list in (thumb_pass_1_args, thumb_pass_2_args, full_pass_1_args, full_pass_2_args):
-            arg_list.insert(-1, "-an")
-
-
-    thumb_pass_1_result = subprocess.run(thumb_pass_1_args, stdout=subprocess.PIPE)
-    thumb_pass_2_result = subprocess.run(thumb_pass_2_args, stdout=subprocess.PIPE)
-    full_pass_1_result = subprocess.run(full_pass_1_args, stdout=subprocess.PIPE)
-    full_pass_2_result = subprocess.run(full_pass_2_args, stdout=subprocess.PIPE)
-
     new_clip['time'] = time
     new_clip['hash'] = video_checksum
     new_clip['slug'] = slug
@@ -240,26 +192,24 @@ def parse_video(video_filename, data_dir, frontend_dir):
     new_clip['start'] = start_time
     new_clip['duration'] = duration
 
-    # Now to move the processed files to their appropriate locations.
+    append_to_day_file(get_clip_data_filename_for_day(day, data_dir), [new_clip])
 
+    # The encodes themselves happen whenever the transcode queue is next drained.
+    queue = TranscodeQueue.for_data_dir(data_dir)
+    for rendition, output_filename in ((THUMB, thumb_filename), (FULL, full_filename)):
+        status = queue.enqueue(video_filename, video_checksum, start_time, duration, audio == "Y", rendition.name,
+                               frontend_dir + output_filename)
+        print("%s: %s" % (rendition.name, status))
 
-    try:
-        with open(get_clip_data_filename_for_day(day, data_dir), 'r') as f:
-            this_day_meta = json.loads(f.read())
-    except FileNotFoundError:
-        this_day_meta = []
-
-    this_day_meta.append(new_clip)
-
-    write_to_file(filename=get_clip_data_filename_for_day(day, data_dir), payload=json.dumps(this_day_meta, indent=2))
-
+    print("Run `python -m thisisthesitebuilder.images.transcode_queue` to encode queued clips.")
     print("====================================\n")
     input("done!")
 
-def parse_image(image_filename, data_dir, frontend_dir):
 
-    image_filename = image_filename
-    img = Image.open(image_filename)
+def read_exif(img):
+    """
+    Returns the orientation, day and time recorded in img's EXIF, or Nones if it has none.
+    """
     try:
         exif = {ExifTags.TAGS[k]: v for k, v in img._getexif().items() if k in ExifTags.TAGS}
         orientation = exif.get('Orientation')
@@ -277,6 +227,110 @@ def parse_image(image_filename, data_dir, frontend_dir):
         day_image_was_taken = None
         time_image_was_taken = None
 
+    return orientation, day_image_was_taken, time_image_was_taken
+
+
+def image_filenames(image_filename, day, slug, image_checksum):
+    """
+    Returns the unchanged, full and thumb paths (relative to the frontend dir) for an image.
+    """
+    file_detail = "{}__".format(slug) if slug else ""
+    file_detail += image_checksum
+
+    original_name = image_filename.split('/')[-1]
+    extension = image_filename.split('.')[-1]
+
+    unchanged_filename = '/apps/multimedia/Image/unchanged/%s__%s.%s' % (original_name, file_detail, extension)
+    full_filename = '/apps/multimedia/Image/full/%s__%s.%s' % (day, file_detail, extension)
+    thumb_filename = '/apps/multimedia/Image/thumbs/%s__%s.%s' % (day, file_detail, extension)
+    return unchanged_filename, full_filename, thumb_filename
+
+
+def image_meta(image_filename, time, caption, tags, image_checksum):
+    slug = slugify(caption[:30]) if caption else ""
+    return OrderedDict((
+        ('caption', caption),
+        ('tags', tags),
+        ('time', time),
+        ('hash', image_checksum),
+        ('slug', slug),
+        ('orig', image_filename.split('/')[-1]),
+        ('ext', image_filename.split('.')[-1]),
+    ))
+
+
+def append_to_day_file(filename, new_meta):
+    """
+    Appends a list of new media meta dicts to the JSON file for a day, creating it if need be.
+    """
+    try:
+        with open(filename, 'r') as f:
+            this_day_meta = json.loads(f.read())
+    except FileNotFoundError:
+        this_day_meta = []
+
+    this_day_meta.extend(new_meta)
+
+    write_to_file(filename=filename, payload=json.dumps(this_day_meta, indent=2))
+
+
+def write_image_derivatives(image_filename, frontend_dir, unchanged_filename, full_filename, thumb_filename,
+                            orientation=None):
+    """
+    Copies the original and writes the full and thumb derivatives from a single decode.
+
+    JPEGs are decoded straight to the nearest power-of-two scale above MAX_SIZE (other formats are
+    reduced by an integer factor) before the Lanczos pass, and the thumb is made from the full-size
+    image rather than from the original.  Returns the seconds spent in each stage.
+    """
+    timings = OrderedDict()
+    full_box = (int(MAX_SIZE), int(MAX_SIZE))
+    thumb_box = (THUMB_SIZE, THUMB_SIZE)
+
+    stage_started = perf_counter()
+    shutil.copyfile(image_filename, frontend_dir + unchanged_filename)
+    timings['copy'] = perf_counter() - stage_started
+
+    stage_started = perf_counter()
+    img = Image.open(image_filename)
+    original_size = img.size
+    img.draft('RGB', full_box)
+    img.load()
+    timings['decode'] = perf_counter() - stage_started
+
+    stage_started = perf_counter()
+    reduce_factor = int(max(img.size[0] / full_box[0], img.size[1] / full_box[1]) / REDUCING_GAP)
+    if reduce_factor > 1 and hasattr(img, 'reduce'):
+        img = img.reduce(reduce_factor)
+    if orientation:
+        img = autorotate(img, orientation)
+    img.thumbnail(full_box, Image.LANCZOS)
+    timings['full'] = perf_counter() - stage_started
+
+    stage_started = perf_counter()
+    thumb = img.copy()
+    thumb.thumbnail(thumb_box, Image.LANCZOS)
+    timings['thumb'] = perf_counter() - stage_started
+
+    stage_started = perf_counter()
+    img.save(frontend_dir + full_filename, "JPEG", quality=60, optimize=True, progressive=True)
+    thumb.save((frontend_dir + thumb_filename), "JPEG")
+    timings['encode'] = perf_counter() - stage_started
+
+    print("%s: %s -> full %s, thumb %s (%s)" % (
+        image_filename, original_size, img.size, thumb.size, format_timings(timings)))
+    return timings
+
+
+def format_timings(timings):
+    return ", ".join("%s %.3fs" % (stage, seconds) for stage, seconds in timings.items())
+
+
+def parse_image(image_filename, data_dir, frontend_dir):
+
+    img = Image.open(image_filename)
+    orientation, day_image_was_taken, time_image_was_taken = read_exif(img)
+
     print("\n====================================")
     print("OK, let's add %s to our IOTD." % sys.argv[1])
 
@@ -291,59 +345,149 @@ def parse_image(image_filename, data_dir, frontend_dir):
     while not time:
         time = what_time(time_image_was_taken)
 
-    # Start our new meta dict by asking for a caption.
-    new_iotd = {'caption': ask_for_caption()}
-    new_iotd['tags'] = ask_for_tags()
+    caption = ask_for_caption()
+    tags = ask_for_tags()
 
-    with open(image_filename, "rb") as f:
-        image_bytes = f.read(1024)
-        image_checksum = hashlib.md5(image_bytes).hexdigest()[:8]
+    hash_cache = HashCache.for_data_dir(data_dir)
+    image_checksum = hash_cache.hash(image_filename)
+    hash_cache.save()
+    new_iotd = image_meta(img.filename, time, caption, tags, image_checksum)
+    unchanged_filename, full_filename, thumb_filename = image_filenames(img.filename, day, new_iotd['slug'],
+                                                                        image_checksum)
 
-    slug = slugify(new_iotd['caption'][:30]) if new_iotd['caption'] else ""
-    file_detail = "{}__".format(slug) if slug else ""
-    file_detail += image_checksum
+    append_to_day_file(get_image_data_filename_for_day(day, data_dir), [new_iotd])
 
-    extension = image_filename.split('.')[-1]
+    write_image_derivatives(image_filename, frontend_dir, unchanged_filename, full_filename, thumb_filename,
+                            orientation)
+    print("====================================\n")
+    input("done!")
 
-    unchanged_filename = '/apps/multimedia/Image/unchanged/%s__%s.%s' % (img.filename.split('/')[-1], file_detail, extension)
-    full_filename = '/apps/multimedia/Image/full/%s__%s.%s' % (day, file_detail, extension)
-    thumb_filename = '/apps/multimedia/Image/thumbs/%s__%s.%s' % (day, file_detail, extension)
 
-    new_iotd['time'] = time
-    new_iotd['hash'] = image_checksum
-    new_iotd['slug'] = slug
-    new_iotd['orig'] = img.filename.split('/')[-1]
-    new_iotd['ext'] = extension
+def read_image_manifest(manifest_filename):
+    """
+    Reads a CSV or YAML manifest of images to ingest.
 
-    h = float(img.size[0])
-    w = float(img.size[1])
-    full_size, thumb_size = calculate_resize(w, h)
+    Each entry has a path and, optionally, a day, time, caption and tags.  Paths are relative to the manifest.
+    In CSV manifests, tags are a single comma-separated column.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_filename))
 
-    try:
-        with open(get_image_data_filename_for_day(day, data_dir), 'r') as f:
-            this_day_meta = json.loads(f.read())
-    except FileNotFoundError:
-        this_day_meta = []
+    with open(manifest_filename, "r") as f:
+        if manifest_filename.endswith(".csv"):
+            entries = list(csv.DictReader(f))
+        else:
+            # Every scalar stays a string - otherwise YAML reads an unquoted 12:30:00 as the base-60 int 45000.
+            entries = yaml.load(f, Loader=yaml.BaseLoader) or []
+
+    manifest = []
+    for entry in entries:
+        if not entry.get('path'):
+            raise ValueError("Manifest entry {} in {} has no path.".format(entry, manifest_filename))
+        tags = entry.get('tags') or []
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        day, time = _manifest_day_and_time(entry, manifest_filename)
+        manifest.append({
+            'path': os.path.join(manifest_dir, entry['path']),
+            'day': day,
+            'time': time,
+            'caption': entry.get('caption') or "",
+            'tags': tags,
+        })
+    return manifest
+
+
+def _manifest_day_and_time(entry, manifest_filename):
+    """
+    The entry's day as YYYY-MM-DD and time as HH:MM:SS (HH:MM gaining :00), either being None if not given.
+    """
+    day = str(entry['day']) if entry.get('day') else None
+    if day is not None and not MANIFEST_DAY.match(day):
+        raise ValueError("Day {} for {} in {} isn't YYYY-MM-DD.".format(day, entry['path'], manifest_filename))
+
+    time = str(entry['time']) if entry.get('time') else None
+    if time is not None:
+        match = MANIFEST_TIME.match(time)
+        if not match:
+            raise ValueError("Time {} for {} in {} isn't HH:MM:SS.".format(time, entry['path'], manifest_filename))
+        time = "{}:{}{}".format(match.group(1), match.group(2), match.group(3) or ":00")
+    return day, time
+
+
+def ingest_image(entry, frontend_dir):
+    """
+    Decodes, resizes and writes the derivatives for one manifest entry.
+
+    Returns the day, the meta for that day's JSON and the per-stage timings.  Days and times fall back to the EXIF DateTime, and times to midnight.
+    """
+    image_filename = entry['path']
+    img = Image.open(image_filename)
+    orientation, day_image_was_taken, time_image_was_taken = read_exif(img)
 
-    this_day_meta.append(new_iotd)
+    day = entry['day'] or day_image_was_taken
+    if not day:
+        raise ValueError("{} has no day in the manifest and no EXIF DateTime.".format(image_filename))
 
-    write_to_file(filename=get_image_data_filename_for_day(day, data_dir), payload=json.dumps(this_day_meta, indent=2))
+    time = entry['time'] or time_image_was_taken or "00:00:00"
 
-    print("Saving original (%s, %s)" % (w, h))
-    shutil.copyfile(image_filename, frontend_dir + unchanged_filename)
+    image_checksum = entry.get('hash') or file_hash(image_filename)
+    new_iotd = image_meta(image_filename, time, entry['caption'], entry['tags'], image_checksum)
+    unchanged_filename, full_filename, thumb_filename = image_filenames(image_filename, day, new_iotd['slug'],
+                                                                        image_checksum)
 
-    print("full: resizing from (%s, %s) to %s" % (w, h, full_size))
-    if orientation:
-        img = autorotate(img, orientation)
-    img.thumbnail(full_size, Image.ANTIALIAS)
-    img.save(frontend_dir + full_filename, "JPEG", quality=60, optimize=True, progressive=True)
-    print("------------------------------------")
-    print("thumb: resizing from (%s, %s) to %s" % (w, h, thumb_size))
-    thumb = Image.open(image_filename)
-    if orientation:
-        thumb = autorotate(thumb, orientation)
-    thumb.thumbnail(thumb_size, Image.ANTIALIAS)
-    thumb.save((frontend_dir + thumb_filename), "JPEG")
-    print("====================================\n")
-    input("done!")
+    timings = write_image_derivatives(image_filename, frontend_dir, unchanged_filename, full_filename,
+                                      thumb_filename, orientation)
+    return day, new_iotd, timings
 
+
+def _ingest_image_in_worker(entry_and_frontend_dir):
+    entry, frontend_dir = entry_and_frontend_dir
+    try:
+        day, new_iotd, timings = ingest_image(entry, frontend_dir)
+    except Exception as e:
+        return entry['path'], None, "{}: {}".format(e.__class__.__name__, e), None
+    return entry['path'], day, new_iotd, timings
+
+
+def parse_images_from_manifest(manifest_filename, data_dir, frontend_dir, processes=None):
+    """
+    Non-interactive counterpart to parse_image for a whole manifest of images.
+
+    Derivatives are written across a pool of processes (one per core by default), and each day's JSON
+    is appended to once, after every image for that day has been processed.
+    """
+    manifest = read_image_manifest(manifest_filename)
+    print("Ingesting %s images from %s" % (len(manifest), manifest_filename))
+
+    # Images we've already hashed keep their hash; the workers hash the rest.
+    hash_cache = HashCache.for_data_dir(data_dir)
+    for entry in manifest:
+        entry['hash'] = hash_cache.lookup(entry['path'])
+
+    meta_by_day = {}
+    failures = []
+    total_timings = OrderedDict()
+
+    with multiprocessing.Pool(processes) as pool:
+        work = [(entry, frontend_dir) for entry in manifest]
+        for path, day, result, timings in pool.imap(_ingest_image_in_worker, work):
+            if day is None:
+                print("*** Couldn't ingest %s - %s" % (path, result))
+                failures.append(path)
+            else:
+                meta_by_day.setdefault(day, []).append(result)
+                hash_cache.store(path, result['hash'])
+                for stage, seconds in timings.items():
+                    total_timings[stage] = total_timings.get(stage, 0) + seconds
+
+    hash_cache.save()
+
+    for day, new_meta in sorted(meta_by_day.items()):
+        new_meta.sort(key=lambda m: m['time'])
+        append_to_day_file(get_image_data_filename_for_day(day, data_dir), new_meta)
+
+    print("====================================")
+    print("Ingested %s images across %s days; %s failed." % (
+        len(manifest) - len(failures), len(meta_by_day), len(failures)))
+    print("CPU time by stage: %s" % format_timings(total_timings))
+    return failures
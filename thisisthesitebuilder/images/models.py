@@ -1,5 +1,11 @@
 import os
 
+from thisisthebus.settings.constants import TIMEZONE_UTC_OFFSET
+
+from thisisthesitebuilder.utils.datetime_formatting import epoch_of
+from thisisthesitebuilder.utils.fingerprint import combined_fingerprint
+from thisisthesitebuilder.utils.hashing import LEGACY_HASH_LENGTH, file_hash, legacy_checksum
+
 
 class Multimedia(object):
 
@@ -10,6 +16,8 @@ class Multimedia(object):
         self._slug = slug
         self.time = time
         self.date = date
+        self._date_and_time = date + "T" + time
+        self._epoch = epoch_of(self._date_and_time + TIMEZONE_UTC_OFFSET)
         self.extension = ext
         self.is_used = False
 
@@ -17,7 +25,10 @@ class Multimedia(object):
         return "{} {} ({})".format(self.date, self.distinguisher(), self.slug())
 
     def date_and_time(self):
-        return self.date + "T" + self.time
+        return self._date_and_time
+
+    def epoch(self):
+        return self._epoch
 
     @classmethod
     def set_storage_url_path(cls, storage_path):
@@ -66,6 +77,18 @@ class Multimedia(object):
     def distinguisher(self):
         raise RuntimeError("distinguisher hasn't been set on this class.")
 
+    def fingerprint(self):
+        """
+        A hash of everything about this piece of media that can show up on a page.
+        """
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = combined_fingerprint(
+                self.__class__.__name__, self.distinguisher(), self.filename(), self.caption, self.tags,
+                self._date_and_time)
+            return self._fingerprint
+
 
 class Image(Multimedia):
 
@@ -91,10 +114,9 @@ class Image(Multimedia):
 
     def checksum_of_unchanged_file(self):
         unchanged_path = self.full_file_path("unchanged")
-        with open(unchanged_path, "rb") as f:
-            image_bytes = f.read(1024)
-            image_checksum = hashlib.md5(image_bytes).hexdigest()[:8]
-        return image_checksum
+        if len(self._hash) == LEGACY_HASH_LENGTH:
+            return legacy_checksum(unchanged_path)
+        return file_hash(unchanged_path)
 
     def distinguisher(self):
         return self._hash
@@ -1,10 +1,12 @@
 from django import template
+from thisisthesitebuilder.pages.fragments import render_fragment
+
 register = template.Library()
 
 
 def register_image_tags(image_instance_template_location, media_collection):
 
-    @register.inclusion_tag(image_instance_template_location)
+    @register.simple_tag()
     def include_media(media_detail_dict=None, **media_details):
         # Silly workaround since we can't unpack args in a template.
         if media_detail_dict:
@@ -20,4 +22,5 @@ def register_image_tags(image_instance_template_location, media_collection):
             raise ValueError("Need either slug or distinguisher.")
         context = {'media_object': media_object, 'thumb_width': width, 'media_note': media_details.get('note')}
 
-        return context
\ No newline at end of file
+        # The same media turns up on many pages; render it once per distinct media, width and note.
+        return render_fragment(image_instance_template_location, context)
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import shutil
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from thisisthesitebuilder.images.transcoding import FULL, THUMB, TranscodeScheduler
+
+RENDITIONS = {rendition.name: rendition for rendition in (THUMB, FULL)}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    start TEXT NOT NULL,
+    duration TEXT NOT NULL,
+    audio INTEGER NOT NULL,
+    profile TEXT NOT NULL,
+    output TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (source_hash, start, duration, audio, profile)
+);
+CREATE TABLE IF NOT EXISTS destinations (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    output TEXT NOT NULL,
+    UNIQUE (job_id, output)
+);
+"""
+
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TranscodeQueue(object):
+    """
+    On-disk queue of clip rendition encodes.
+
+    Jobs are keyed by (source hash, start, duration, audio, profile); enqueueing an encode that's already
+    finished just copies the finished file, and jobs left running by a worker that died are picked up again.
+    """
+
+    def __init__(self, db_filename):
+        self.db_filename = db_filename
+        self.connection = sqlite3.connect(db_filename, timeout=30, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_data_dir(cls, data_dir):
+        return cls("%s/compiled/transcode_queue.sqlite3" % data_dir)
+
+    def enqueue(self, source, source_hash, start, duration, audio, profile, output):
+        """
+        Returns the status of the job that will produce output: 'pending', 'running' or 'done' (when reused).
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (source, source_hash, start, duration, audio, profile, output) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, source_hash, start, duration, int(audio), profile, output))
+            job = self.connection.execute(
+                "SELECT * FROM jobs WHERE source_hash = ? AND start = ? AND duration = ? AND audio = ? AND profile = ?",
+                (source_hash, start, duration, int(audio), profile)).fetchone()
+            self.connection.execute("INSERT OR IGNORE INTO destinations (job_id, output) VALUES (?, ?)",
+                                    (job['id'], output))
+
+            status = job['status']
+            if status == 'done' and not os.path.exists(job['output']):
+                print("The finished encode %s has gone missing; queueing it again." % job['output'])
+                status = 'pending'
+            elif status == 'failed':
+                status = 'pending'
+
+            if status == 'pending':
+                # Whatever source we were last given for this content is as good as any other.
+                self.connection.execute("UPDATE jobs SET status = 'pending', source = ?, error = NULL WHERE id = ?",
+                                        (source, job['id']))
+
+        if status == 'done':
+            self._copy_to_destinations(job['id'], job['output'])
+        return status
+
+    def claim(self):
+        """
+        Claims the oldest pending job along with every other pending rendition of the same clip, so they can
+        all be encoded from one decode.  Returns a list of jobs, empty if there's nothing to do.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            oldest = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if oldest is None:
+                return []
+            jobs = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND source_hash = ? AND start = ? AND duration = ? "
+                "AND audio = ? ORDER BY id",
+                (oldest['source_hash'], oldest['start'], oldest['duration'], oldest['audio'])).fetchall()
+            self.connection.executemany(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, attempts = attempts + 1 WHERE id = ?",
+                [(os.getpid(), job['id']) for job in jobs])
+        return jobs
+
+    def complete(self, job):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'done', worker_pid = NULL WHERE id = ?", (job['id'],))
+        self._copy_to_destinations(job['id'], job['output'])
+
+    def fail(self, job, error):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'failed', worker_pid = NULL, error = ? WHERE id = ?",
+                                    (str(error), job['id']))
+
+    def resume_interrupted(self):
+        """
+        Puts jobs claimed by workers that are no longer running back in the queue.  Returns how many.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            orphans = [row['id'] for row in self.connection.execute(
+                "SELECT id, worker_pid FROM jobs WHERE status = 'running'")
+                if not row['worker_pid'] or not _pid_is_alive(row['worker_pid'])]
+            self.connection.executemany("UPDATE jobs SET status = 'pending', worker_pid = NULL WHERE id = ?",
+                                        [(job_id,) for job_id in orphans])
+        return len(orphans)
+
+    def _copy_to_destinations(self, job_id, encoded_filename):
+        for row in self.connection.execute("SELECT output FROM destinations WHERE job_id = ?", (job_id,)):
+            if not os.path.exists(row['output']):
+                print("Reusing %s for %s" % (encoded_filename, row['output']))
+                shutil.copyfile(encoded_filename, row['output'])
+
+    def counts(self):
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def drain(queue, scheduler):
+    """
+    Encodes every pending job, keeping about one clip per core in flight.
+    """
+    resumed = queue.resume_interrupted()
+    if resumed:
+        print("Resuming %s interrupted encodes." % resumed)
+
+    in_flight = {}
+    while True:
+        while len(in_flight) < scheduler.cores:
+            jobs = queue.claim()
+            if not jobs:
+                break
+            first = jobs[0]
+            outputs = {RENDITIONS[job['profile']]: job['output'] for job in jobs}
+            future = scheduler.submit(first['source'], first['start'], first['duration'], outputs,
+                                      bool(first['audio']))
+            in_flight[future] = jobs
+
+        if not in_flight:
+            break
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            jobs = in_flight.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                print("*** Failed to encode %s: %s" % (", ".join(job['output'] for job in jobs), e))
+                for job in jobs:
+                    queue.fail(job, e)
+            else:
+                for job in jobs:
+                    queue.complete(job)
+
+    print("Transcode queue drained: %s" % queue.counts())
+
+
+if __name__ == "__main__":
+    from thisisthebus.settings.constants import DATA_DIR
+
+    scheduler = TranscodeScheduler()
+    drain(TranscodeQueue.for_data_dir(DATA_DIR), scheduler)
+    scheduler.shutdown()
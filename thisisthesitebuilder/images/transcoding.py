@@ -0,0 +1,150 @@
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+Rendition = namedtuple('Rendition', ('name', 'maxrate', 'scale', 'max_duration', 'audio', 'threads'))
+
+# libvpx-vp9 can't use more than one tile column per 256 pixels of width, so the thumb gains little
+# from more than a couple of threads; the full rendition scales (with row-mt) to about eight.
+THUMB = Rendition(name='thumb', maxrate="80000", scale="scale=256:-1", max_duration=10, audio=False, threads=2)
+FULL = Rendition(name='full', maxrate="335000", scale=None, max_duration=None, audio=True, threads=8)
+
+
+def rendition_duration(duration, rendition):
+    if not rendition.max_duration:
+        return duration
+    try:
+        if int(duration) > rendition.max_duration:
+            print("Duration was %s; setting to %s for %s." % (duration, rendition.max_duration, rendition.name))
+            return str(rendition.max_duration)
+    except (TypeError, ValueError):
+        print("Wasn't able to cast %s to int to test for %s duration." % (duration, rendition.name))
+    return duration
+
+
+def split_filter_graph(duration, renditions):
+    """
+    A filter graph that decodes the source once and splits it into one labelled video stream per rendition.
+    """
+    branches = ["[0:v]split={}{}".format(len(renditions), "".join("[split%s]" % i for i in range(len(renditions))))]
+    for i, rendition in enumerate(renditions):
+        filters = []
+        if rendition.scale:
+            filters.append(rendition.scale)
+        rendition_seconds = rendition_duration(duration, rendition)
+        if rendition_seconds != duration:
+            filters.append("trim=duration={},setpts=PTS-STARTPTS".format(rendition_seconds))
+        branches.append("[split{i}]{filters}[out{i}]".format(i=i, filters=",".join(filters or ["null"])))
+    return ";".join(branches)
+
+
+def vp9_pass_args(source, start, duration, outputs, pass_number, passlog_dir, audio, threads):
+    """
+    ffmpeg arguments for one pass of a two-pass VP9 encode of every rendition in outputs (a dict of
+    Rendition to output filename), all fed from a single decode of the source.
+
+    Each rendition gets its own passlogfile, so the first pass's statistics for all of them come out of
+    one run, and any number of clips can be encoded side by side.
+    """
+    renditions = list(outputs)
+    args = ["ffmpeg", "-y", "-ss", start, "-t", duration, "-i", source,
+            "-filter_complex", split_filter_graph(duration, renditions)]
+
+    for i, rendition in enumerate(renditions):
+        rendition_threads = threads[rendition]
+        tile_columns = int(math.log2(rendition_threads)) if rendition_threads > 1 else 0
+        args += [
+            "-map", "[out%s]" % i,
+            "-maxrate", rendition.maxrate, "-c:v", "libvpx-vp9", "-pass", str(pass_number),
+            "-passlogfile", os.path.join(passlog_dir, rendition.name), "-b:v", "1000K",
+            "-threads", str(rendition_threads), "-row-mt", "1",
+            "-speed", "4" if pass_number == 1 else "0", "-tile-columns", str(tile_columns),
+            "-frame-parallel", "0", "-auto-alt-ref", "1", "-lag-in-frames", "25", "-g", "9999",
+            "-aq-mode", "0"]
+
+        if pass_number == 2 and audio and rendition.audio:
+            args += ["-map", "0:a:0?", "-c:a", "libopus", "-b:a", "64k"]
+        else:
+            args += ["-an"]
+
+        args += ["-f", "webm", outputs[rendition] if pass_number == 2 else "/dev/null"]
+    return args
+
+
+def encode_clip(source, start, duration, outputs, audio, threads):
+    passlog_dir = tempfile.mkdtemp(prefix="vp9-passlog-")
+    try:
+        for pass_number in (1, 2):
+            args = vp9_pass_args(source, start, duration, outputs, pass_number, passlog_dir, audio, threads)
+            subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    finally:
+        shutil.rmtree(passlog_dir, ignore_errors=True)
+    for rendition, output_filename in outputs.items():
+        print("Encoded %s %s" % (rendition.name, output_filename))
+    return list(outputs.values())
+
+
+class TranscodeScheduler(object):
+    """
+    Runs clip encodes concurrently while keeping the threads handed to ffmpeg within the core count.
+
+    Each encode reserves its threads from a shared budget before it starts and returns them when it
+    finishes, so clips can be submitted freely without oversubscribing the machine.
+    """
+
+    def __init__(self, cores=None):
+        self.cores = cores or os.cpu_count() or 1
+        self._available_cores = self.cores
+        self._cores_freed = threading.Condition()
+        # Every running encode holds at least one core, so there's never any use for more workers than cores.
+        self._executor = ThreadPoolExecutor(max_workers=self.cores)
+
+    def threads_for(self, renditions):
+        """
+        Threads for each rendition, scaled down together if they'd add up to more than the cores we have.
+        """
+        wanted = sum(rendition.threads for rendition in renditions)
+        scale = min(1.0, self.cores / wanted)
+        return {rendition: max(1, int(rendition.threads * scale)) for rendition in renditions}
+
+    def _reserve(self, threads):
+        with self._cores_freed:
+            while self._available_cores < threads:
+                self._cores_freed.wait()
+            self._available_cores -= threads
+
+    def _release(self, threads):
+        with self._cores_freed:
+            self._available_cores += threads
+            self._cores_freed.notify_all()
+
+    def _encode(self, source, start, duration, outputs, audio):
+        threads = self.threads_for(outputs)
+        reserved = min(self.cores, sum(threads.values()))
+        self._reserve(reserved)
+        try:
+            return encode_clip(source, start, duration, outputs, audio, threads)
+        finally:
+            self._release(reserved)
+
+    def submit(self, source, start, duration, outputs, audio):
+        """
+        Takes a dict of Rendition to output filename and encodes all of them from one decode of the source.
+        Returns a future.
+        """
+        return self._executor.submit(self._encode, source, start, duration, dict(outputs), audio)
+
+    @staticmethod
+    def wait(futures):
+        """
+        Blocks until every future is done, raising the first failure.
+        """
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,22 +1,109 @@
+import multiprocessing
+import os
+
+import maya
+
+from thisisthesitebuilder.pages.fragments import configure_fragment_cache, fragment_cache_dir, prune_fragment_cache
 from thisisthesitebuilder.pages.models import Page
+from thisisthesitebuilder.pages.parsers import configure_parse_cache_for_build, prune_parse_cache
+from thisisthesitebuilder.pages.templates import templates_fingerprint
+from thisisthesitebuilder.utils.dependencies import Dependencies, authored_path
+from thisisthesitebuilder.utils.yaml_loader import prune_yaml_cache
+
+# Set in the parent just before build_pages forks its workers, which inherit them rather than having every
+# spec's context (experiences, media and all) pickled across to them.
+_pool_builder = None
+_pool_specs = None
+
+# How long a cached blob, fragment or YAML parse may go unused before prune_caches deletes it.  Pages whose
+# dependencies haven't changed aren't rendered, so their entries can go unused for many builds and still
+# be wanted the next time one of them is.
+CACHE_RETENTION_DAYS = 60
+
+
+def _build_page_in_worker(index):
+    page = _pool_builder.build_page(write_meta=False, **_pool_specs[index])
+    last_updated = page.last_updated()
+    return (index, page.pending_meta, last_updated and last_updated.iso8601(), page.active_context.get('title'),
+            page.updated)
 
 
 class PageBuilder(object):
     def __init__(self, build_meta, force_rebuild=False):
         self.build_meta = build_meta
         self.force_rebuild = force_rebuild
+        self._templates_fingerprint = None
+
+        configure_parse_cache_for_build(build_meta, self.templates_fingerprint())
+        configure_fragment_cache(fragment_cache_dir(build_meta['data_dir']), salt=self.templates_fingerprint())
+
+    def templates_fingerprint(self):
+        if self._templates_fingerprint is None:
+            self._templates_fingerprint = templates_fingerprint()
+        return self._templates_fingerprint
+
+    def prune_caches(self, retention_days=CACHE_RETENTION_DAYS):
+        """
+        Call once the build has finished: deletes every cached blob, fragment and YAML parse that nothing (in
+        any process) has written or used in the last retention_days.
+        """
+        since = self.build_meta['datetime'].epoch - retention_days * 60 * 60 * 24
+        print("Pruned {} parsed blobs, {} fragments and {} parsed YAML files.".format(
+            prune_parse_cache(since), prune_fragment_cache(since), prune_yaml_cache(self.build_meta['data_dir'], since)))
+
+    def page_dependencies(self, page, depends_on):
+        """
+        What the page reads: whatever the caller says its context read, plus the page's own YAML and body.
+        """
+        if isinstance(depends_on, Dependencies):
+            dependencies = depends_on
+        else:
+            dependencies = Dependencies.combine(*depends_on)
+        data_dir = self.build_meta['data_dir']
+        dependencies = dependencies.with_inputs(
+            authored_path(data_dir, "%s/authored/pages/%s.yaml" % (data_dir, page.name)),
+            authored_path(data_dir, "%s/authored/pages/%s-body.md" % (data_dir, page.name)))
+        dependencies.templates = self.templates_fingerprint()
+        digests = self.build_meta.get('digests')
+        if digests is not None:
+            dependencies.stamp(digests)
+        return dependencies
 
     def build_page(self, name, directory=None, template_name=None, root=False, active_context=None,
-                   passive_context=None, compact=False, force_rebuild=None):
+                   passive_context=None, compact=False, force_rebuild=None, depends_on=None, write_meta=True):
         '''
         Takes a page name, checks to see if custom template or YAML files exist, writes HTML to frontend directory as defined in self.build_meta.
+
+        depends_on (Dependencies, or a list of them) declares what the page's context was built from.  When
+        build_meta has the 'digests' of the authored files (from get_hashes), a page whose dependencies read
+        just what they did when it was last rendered isn't rendered or written at all.
+
+        Context values may be LazyContexts (or plain functions), which are only computed if the page renders;
+        until then, their declared fingerprints stand in for them in the page's checksum.
+
+        With write_meta=False, the page's new meta is left in page.pending_meta rather than written.
         '''
         if force_rebuild is None:
             force_rebuild = self.force_rebuild
 
         page = Page(name, self.build_meta, directory=directory, template_name=template_name, root=root,
                     active_context=active_context, passive_context=passive_context, compact=compact,
-                    force_rebuild=force_rebuild)
+                    force_rebuild=force_rebuild, templates_fingerprint=self.templates_fingerprint())
+
+        final_output_filename = "%s/%s" % (self.build_meta['frontend_dir'], page.output_filename)
+        if not os.path.exists(final_output_filename):
+            # Whatever the checksums say, there's nothing on disk to keep.
+            force_rebuild = True
+
+        dependencies = None
+        if depends_on is not None:
+            dependencies = self.page_dependencies(page, depends_on)
+            previous_meta = page.previous_meta(quiet=True)
+            if not force_rebuild and previous_meta:
+                if not dependencies.needs_rebuild(previous_meta.get('dependencies')):
+                    page.active_context['title'] = previous_meta.get('title', name)
+                    page._last_updated = maya.MayaDT.from_iso8601(previous_meta['last_update'])
+                    return page
 
         #######################  Make sure directory exists
 
@@ -27,11 +114,56 @@ class PageBuilder(object):
 
         page.update_from_yaml(yaml_filename)
 
-        page.render(force_rebuild=True)
+        page.render(force_rebuild=force_rebuild, dependencies=dependencies, write_meta=write_meta)
 
         if page.updated:
-            final_output_filename = "%s/%s" % (self.build_meta['frontend_dir'], page.output_filename)
             with open(final_output_filename, "w+") as f:
                 f.write(page.html)
 
         return page
+
+    def build_pages(self, specs, processes=None):
+        """
+        Takes a list of dicts of keyword arguments for build_page, and builds all of them across a pool of
+        forked processes (one per core by default).  Returns the Pages, in the same order.
+
+        Call this once everything the pages read (SUMMARIES, LOCATIONS, INTERTWINED_MEDIA, experiences) is
+        loaded: the workers see it all as it was when they were forked.  They render the templates and write
+        the HTML; the meta for every page is written here, by the parent, once they're done.
+        """
+        global _pool_builder, _pool_specs
+
+        specs = list(specs)
+        if processes == 1 or len(specs) < 2:
+            return [self.build_page(**spec) for spec in specs]
+
+        # Compute this once, before forking, rather than once per worker.
+        self.templates_fingerprint()
+
+        _pool_builder, _pool_specs = self, specs
+        try:
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.map(_build_page_in_worker, range(len(specs)))
+        finally:
+            _pool_builder, _pool_specs = None, None
+
+        pages = []
+        for index, pending_meta, last_update, title, updated in sorted(results, key=lambda result: result[0]):
+            spec = dict(specs[index])
+            spec.pop('depends_on', None)
+            if spec.get('force_rebuild') is None:
+                spec['force_rebuild'] = self.force_rebuild
+            page = Page(spec.pop('name'), self.build_meta, templates_fingerprint=self.templates_fingerprint(),
+                        **spec)
+            if title is not None:
+                page.active_context['title'] = title
+            if last_update is not None:
+                page._last_updated = maya.MayaDT.from_iso8601(last_update)
+            page.updated = updated
+            page.pending_meta = pending_meta
+            page.write_meta()
+            pages.append(page)
+
+        print("Built %s pages across %s processes; %s changed." % (
+            len(pages), processes or os.cpu_count(), sum(page.updated for page in pages)))
+        return pages
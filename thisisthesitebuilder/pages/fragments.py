@@ -0,0 +1,76 @@
+import hashlib
+import pathlib
+
+from django.utils.safestring import mark_safe
+
+from thisisthesitebuilder.pages.templates import template_registry
+from thisisthesitebuilder.utils.file_utils import mark_used, prune_unused, write_atomically
+from thisisthesitebuilder.utils.fingerprint import fingerprint_of
+
+_rendered = {}
+_cache = {'dir': None, 'salt': None}
+
+
+def configure_fragment_cache(cache_dir=None, salt=None):
+    """
+    Sets where rendered fragments persist between builds (None to keep them in memory only), and the salt -
+    the templates fingerprint - that retires all of them whenever any template changes.
+    """
+    if cache_dir:
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    _cache['dir'] = cache_dir
+    _cache['salt'] = salt
+    _rendered.clear()
+
+
+def fragment_cache_dir(data_dir):
+    return "%s/compiled/fragments" % data_dir
+
+
+def prune_fragment_cache(since):
+    """
+    Deletes every fragment not used since the epoch since - those for templates, media or experiences that
+    have since changed, and any no page shows any more.
+    """
+    if not _cache['dir']:
+        return 0
+    return prune_unused(_cache['dir'], since)
+
+
+def _fragment_key(template_name, context):
+    distinguisher = [template_name, fingerprint_of(context), _cache['salt']]
+    return hashlib.blake2b(str(distinguisher).encode(), digest_size=16).hexdigest()
+
+
+def render_fragment(template_name, context):
+    """
+    Renders template_name with context, once per distinct (template, context) - the context's objects
+    being told apart by their fingerprints - however many pages the fragment appears on.
+
+    Until configure_fragment_cache is given a salt, there's no telling whether the templates have changed
+    since a fragment was stored on disk, so fragments are only kept in memory.
+    """
+    key = _fragment_key(template_name, context)
+    try:
+        return _rendered[key]
+    except KeyError:
+        pass
+
+    persist = _cache['dir'] and _cache['salt']
+    filename = "%s/%s.html" % (_cache['dir'], key)
+    fragment = None
+    if persist:
+        try:
+            with open(filename, "r") as f:
+                fragment = f.read()
+            mark_used(filename)
+        except FileNotFoundError:
+            pass
+
+    if fragment is None:
+        fragment = template_registry().get_template(template_name).render(context)
+        if persist:
+            write_atomically(filename, fragment)
+
+    fragment = _rendered[key] = mark_safe(fragment)
+    return fragment
@@ -1,19 +1,67 @@
 import hashlib
 import json
 import pathlib
+import types
 
 import maya
-import yaml
-from django.template.exceptions import TemplateDoesNotExist
-from django.template.loader import get_template
 
 from thisisthesitebuilder.pages.parsers import parse_markdown_and_django_template
-from thisisthesitebuilder.utils.yaml_loader import md_field_from_file
+from thisisthesitebuilder.pages.templates import template_registry, templates_fingerprint
+from thisisthesitebuilder.utils.fingerprint import combined_fingerprint, fingerprint_of
+from thisisthesitebuilder.utils.yaml_loader import load_yaml_file, md_field_from_file, yaml_cache_dir
+
+
+class LazyContext(object):
+    """
+    A context value that's only computed if the page it's on actually renders.
+
+    fingerprint stands in for the value when deciding whether the page has changed: anything that changes
+    whenever the value would (or a callable returning such a thing).  It should be much cheaper to come by
+    than the value itself.  Without one, the value is computed after all, and fingerprinted instead.
+    """
+
+    def __init__(self, fingerprint, provider):
+        self._fingerprint = fingerprint
+        self.provider = provider
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            return fingerprint_of(self.resolve())
+        if callable(self._fingerprint):
+            return fingerprint_of(self._fingerprint())
+        return fingerprint_of(self._fingerprint)
+
+    def resolve(self):
+        try:
+            return self._value
+        except AttributeError:
+            self._value = self.provider()
+            return self._value
+
+
+def lazy_context(context):
+    """
+    Wraps any plain functions among the values of context as LazyContexts (with no fingerprint of their own),
+    and returns context.  Bound methods and classes are left as they are, for the template to call if it likes.
+    """
+    for key, value in context.items():
+        if isinstance(value, types.FunctionType):
+            context[key] = LazyContext(None, value)
+    return context
+
+
+def resolve_context(context):
+    """
+    Replaces every LazyContext in context with its value.
+    """
+    for key, value in context.items():
+        if isinstance(value, LazyContext):
+            context[key] = value.resolve()
 
 
 class Page(object):
     def __init__(self, name, build_meta, directory=None, template_name=None, root=False, active_context=None,
-                 passive_context=None, compact=False, force_rebuild=False):
+                 passive_context=None, compact=False, force_rebuild=False, templates_fingerprint=None):
         self.name = name
         self.build_meta = build_meta
         self.template_name = template_name
@@ -31,11 +79,13 @@ class Page(object):
         self.full_name = "%s.html" % self.name
         self.output_filename = "%s.html" % self.name
 
-        self.active_context = active_context or {}
-        self.passive_context = passive_context or {}
+        self.active_context = lazy_context(active_context or {})
+        self.passive_context = lazy_context(passive_context or {})
         self.compact = compact
         self.force_rebuild = force_rebuild
+        self.templates_fingerprint = templates_fingerprint
         self.updated = False
+        self.pending_meta = None
 
     def __str__(self):
         return self.name
@@ -43,6 +93,14 @@ class Page(object):
     def __repr__(self):
         return str(self)
 
+    def fingerprint(self):
+        """
+        What another page can show of this one: where it is, what it's called and when it last changed.
+        """
+        last_updated = getattr(self, '_last_updated', None)
+        return combined_fingerprint(self.name, self.output_filename, self.pretty_name(),
+                                    last_updated and last_updated.iso8601())
+
     def json_meta_directory(self):
         return "%s/compiled/pages" % self.build_meta['data_dir']
 
@@ -54,8 +112,11 @@ class Page(object):
         if not self.context_is_built:
             raise RuntimeError("You need to build context for this page first.")
 
+        if self.templates_fingerprint is None:
+            self.templates_fingerprint = templates_fingerprint()
+
         distinguisher = str(
-            [(str(k), str(v)) for k, v in sorted(self.active_context.items())]
+            [(str(k), fingerprint_of(v)) for k, v in sorted(self.active_context.items())] + [self.templates_fingerprint]
         ).encode()
         return hashlib.md5(distinguisher).hexdigest()
 
@@ -88,7 +149,7 @@ class Page(object):
         return meta
 
     def find_previous_checksum(self):
-        previous_meta = self.previous_meta()
+        previous_meta = self.previous_meta(quiet=True)
         if previous_meta is None:
             self._previous_checksum = None
         else:
@@ -97,37 +158,36 @@ class Page(object):
     def update_from_yaml(self, yaml_file):
 
         try:
-            with open(yaml_file, "r") as f:
-                page_yaml = yaml.safe_load(f)
+            page_yaml = load_yaml_file(yaml_file, cache_dir=yaml_cache_dir(self.build_meta['data_dir']))
 
-                self.active_context['compact'] = self.compact
-                self.active_context['name'] = self.name
+            self.active_context['compact'] = self.compact
+            self.active_context['name'] = self.name
 
-                self.active_context['title'] = self.active_context['page_title'] = page_yaml.pop(
-                    'title',
-                    self.name)
+            self.active_context['title'] = self.active_context['page_title'] = page_yaml.pop(
+                'title',
+                self.name)
 
-                body_content = page_yaml.pop('body_content', "")
+            body_content = page_yaml.pop('body_content', "")
 
-                if not body_content:
-                    body_content = md_field_from_file(self.build_meta['data_dir'], "pages", self.name,
-                                                      "-body")
-                #     try:
-                #         body_content_filename = (
-                #             "%s/authored/pages/%s" % (self.build_meta['data_dir'], self.full_page_name)).replace(
-                #             ".html",
-                #             "-body.md")
-                #         with open(body_content_filename, "r") as f:
-                #             body_content = f.read()
-                #     except FileNotFoundError:
-                #         pass
-                #
+            if not body_content:
+                body_content = md_field_from_file(self.build_meta['data_dir'], "pages", self.name,
+                                                  "-body")
+            #     try:
+            #         body_content_filename = (
+            #             "%s/authored/pages/%s" % (self.build_meta['data_dir'], self.full_page_name)).replace(
+            #             ".html",
+            #             "-body.md")
+            #         with open(body_content_filename, "r") as f:
+            #             body_content = f.read()
+            #     except FileNotFoundError:
+            #         pass
+            #
 
-                if body_content:
-                    self.active_context['body_content'] = parse_markdown_and_django_template(
-                        body_content)
+            if body_content:
+                self.active_context['body_content'] = parse_markdown_and_django_template(
+                    body_content)
 
-                self.active_context.update(page_yaml)
+            self.active_context.update(page_yaml)
 
 
         except FileNotFoundError:
@@ -136,13 +196,27 @@ class Page(object):
 
         self.context_is_built = True
 
-    def render(self, force_rebuild=None):
+    def render(self, force_rebuild=None, dependencies=None, write_meta=True):
+        """
+        Renders the page to self.html if it has changed (or force_rebuild), and records its new meta.
+
+        With write_meta=False the meta is left in self.pending_meta for the caller to write_meta() later -
+        say, from the parent of the process that did the rendering.
+        """
         if force_rebuild is None:
             force_rebuild = self.force_rebuild
 
-        if not force_rebuild and self.current_checksum() == self.previous_checksum():
+        # Taken while any LazyContexts are still standing in for their values.
+        checksum = self.current_checksum()
+
+        if not force_rebuild and checksum == self.previous_checksum():
             # No need to rebuild this page; it hasn't changed.
-            self._last_updated = maya.MayaDT.from_iso8601(self.previous_meta()['last_update'])
+            page_meta = self.previous_meta()
+            self._last_updated = maya.MayaDT.from_iso8601(page_meta['last_update'])
+            if dependencies is not None and page_meta.get('dependencies') != dependencies.to_json():
+                # What the page reads has moved on even though the page hasn't; remember that for next time.
+                page_meta['dependencies'] = dependencies.to_json()
+                self.pending_meta = page_meta
         else:
             print("{} has changed.".format(self.name))
 
@@ -154,28 +228,37 @@ class Page(object):
                     last_update = self.build_meta['datetime']
             else:
                 last_update = self.build_meta['datetime']
-            page_meta = {'page_checksum': self.current_checksum(),
-                         'last_update': last_update.iso8601()}
-
-            with open(self.json_meta_filename(), "w") as f:
-                f.write(json.dumps(page_meta))
+            page_meta = {'page_checksum': checksum,
+                         'last_update': last_update.iso8601(),
+                         'title': self.pretty_name()}
+            if dependencies is not None:
+                page_meta['dependencies'] = dependencies.to_json()
+            self.pending_meta = page_meta
 
             self.active_context['build_time'] = last_update.datetime(to_timezone='US/Eastern',
                                                                      naive=True)
             self.active_context.update(self.passive_context)
+            resolve_context(self.active_context)
 
-            # Let's see if there's a special template for this page.
-            try:
-                template = get_template('page_specific/%s' % self.full_name)
-            except TemplateDoesNotExist:
-                template_name = self.template_name or self.active_context.get(
-                    "template") or 'shared/generic-page.html'
-                template = get_template(template_name)
+            # Use the special template for this page if there is one.
+            template_name = self.template_name or self.active_context.get(
+                "template") or 'shared/generic-page.html'
+            template = template_registry().page_template(self.full_name, template_name)
 
             self.html = template.render(self.active_context)
             self.updated = True
             self._last_updated = last_update
 
+        if write_meta:
+            self.write_meta()
+
+    def write_meta(self):
+        if self.pending_meta is None:
+            return
+        with open(self.json_meta_filename(), "w") as f:
+            f.write(json.dumps(self.pending_meta))
+        self.pending_meta = None
+
     def last_updated(self):
         return self._last_updated
 
@@ -1,11 +1,145 @@
+import hashlib
+import pathlib
+import re
+from collections import OrderedDict
+
 import markdown
+from django.utils.safestring import mark_safe
+
+from thisisthesitebuilder.utils.file_utils import mark_used, prune_unused, write_atomically
+from thisisthesitebuilder.utils.fingerprint import fingerprint_of
+
+MARKDOWN_EXTENSIONS = ['markdown.extensions.tables']
+
+# Anything that Django would treat as a tag, variable or comment.
+TEMPLATE_SYNTAX = re.compile(r"{[{%#]")
+
+MEMORY_CACHE_SIZE = 4096
+
+_markdown = None
+_compiled_templates = {}
+_rendered = OrderedDict()
+_cache = {'dir': None, 'salt': None}
+
+
+def configure_parse_cache(cache_dir=None, salt=None):
+    """
+    Sets where rendered blobs persist between builds (None to keep them in memory only), and the salt for
+    any blob with template syntax in it - which can render differently whenever the data or templates do.
+    """
+    if cache_dir:
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    _cache['dir'] = cache_dir
+    _cache['salt'] = salt
+    _rendered.clear()
+
+
+def parse_cache_dir(data_dir):
+    return "%s/compiled/parsed" % data_dir
+
+
+def configure_parse_cache_for_build(build_meta, templates_fingerprint):
+    """
+    Configures the cache the way every builder should: under the data dir's compiled/parsed, and salted
+    with the data checksum and templates_fingerprint - templated prose renders differently if either has
+    changed; plain prose never does.  Without a data checksum, templated prose isn't cached at all.
+    """
+    salt = None
+    if build_meta.get('data_checksum'):
+        salt = (build_meta['data_checksum'], templates_fingerprint)
+    configure_parse_cache(parse_cache_dir(build_meta['data_dir']), salt=salt)
+
+
+def prune_parse_cache(since):
+    """
+    Deletes every parsed blob not used since the epoch since.  Templated blobs are keyed on the data
+    checksum, so without this, every build that changes any data leaves a full set of them behind.
+    """
+    if not _cache['dir']:
+        return 0
+    return prune_unused(_cache['dir'], since)
+
+
+def _convert_markdown(blob):
+    global _markdown
+    if _markdown is None:
+        _markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return _markdown.reset().convert(blob)
+
+
+def _compiled_template(source):
+    key = hashlib.blake2b(source.encode()).hexdigest()
+    try:
+        return _compiled_templates[key]
+    except KeyError:
+        from django.template import engines
+        template = _compiled_templates[key] = engines['django'].from_string(source)
+        return template
+
+
+def _cache_key(blob, context, templated):
+    distinguisher = [blob, MARKDOWN_EXTENSIONS, fingerprint_of(context)]
+    if templated:
+        distinguisher.append(_cache['salt'])
+    return hashlib.blake2b(str(distinguisher).encode(), digest_size=16).hexdigest()
+
+
+def _read_from_disk(key):
+    if not _cache['dir']:
+        return None
+    filename = "%s/%s.html" % (_cache['dir'], key)
+    try:
+        with open(filename, "r") as f:
+            rendered_content = f.read()
+    except FileNotFoundError:
+        return None
+    mark_used(filename)
+    return rendered_content
+
+
+def _write_to_disk(key, rendered_content):
+    if not _cache['dir']:
+        return
+    write_atomically("%s/%s.html" % (_cache['dir'], key), rendered_content)
+
+
+def _render(blob, context):
+    parsed_markdown = _convert_markdown(blob)
+    if not TEMPLATE_SYNTAX.search(parsed_markdown):
+        # Nothing for Django to do.
+        return mark_safe(parsed_markdown)
+    return mark_safe(_compiled_template(parsed_markdown).render(context))
 
 
 def parse_markdown_and_django_template(blob, context=None):
+    """
+    Renders blob as markdown, then as a Django template, returning it marked safe, as Django would.
+
+    Results are cached in memory and (once configure_parse_cache has been given a directory) on disk, by
+    blob, markdown extensions and context - and, for blobs that use template syntax, the salt.
+    """
     context = context or {}
-    from django.template import engines
-    django_template_engine = engines['django']
-    parsed_markdown = markdown.markdown(blob, extensions=['markdown.extensions.tables'])
-    templated_content = django_template_engine.from_string(parsed_markdown)
-    rendered_content = templated_content.render(context)
+    templated = bool(TEMPLATE_SYNTAX.search(blob))
+    if templated and _cache['salt'] is None:
+        # Without a salt, there's no telling whether the data behind the template has changed.
+        return _render(blob, context)
+
+    key = _cache_key(blob, context, templated)
+    try:
+        _rendered.move_to_end(key)
+        return _rendered[key]
+    except KeyError:
+        pass
+
+    rendered_content = _read_from_disk(key)
+    if rendered_content is None:
+        rendered_content = _render(blob, context)
+        _write_to_disk(key, rendered_content)
+    else:
+        # As it was when it was rendered, before it went through a file.
+        rendered_content = mark_safe(rendered_content)
+
+    _rendered[key] = rendered_content
+    if len(_rendered) > MEMORY_CACHE_SIZE:
+        _rendered.popitem(last=False)
     return rendered_content
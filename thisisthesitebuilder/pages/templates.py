@@ -0,0 +1,112 @@
+import hashlib
+import os
+
+from django.template import Origin, Template, TemplateDoesNotExist, engines
+from django.template.backends.django import Template as BackendTemplate
+from django.template.utils import get_app_template_dirs
+
+_registries = {}
+
+
+def template_dirs():
+    """
+    Every directory the Django engine loads templates from, project dirs first.
+    """
+    engine = engines['django'].engine
+    dirs = list(engine.dirs)
+    if engine.app_dirs:
+        dirs += [str(app_dir) for app_dir in get_app_template_dirs('templates')]
+    return dirs
+
+
+def templates_fingerprint():
+    """
+    A hash of the path and mtime of every template file, which changes whenever any template (including
+    anything a template extends or includes) does.
+    """
+    fingerprint = hashlib.md5()
+    for template_dir in template_dirs():
+        for directory, _, filenames in sorted(os.walk(template_dir)):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                fingerprint.update("{}:{}\n".format(path, os.stat(path).st_mtime_ns).encode())
+    return fingerprint.hexdigest()
+
+
+class TemplateRegistry(object):
+    """
+    Every template in the template dirs, found in a single scan, and compiled at most once per change.
+
+    Compiled templates are kept by name and thrown away when their file's mtime moves on.  hits and
+    misses count how often a compiled template was reused or had to be (re)compiled.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._compiled = {}
+        self.scan()
+
+    def scan(self):
+        """
+        Finds the file behind every template name, the first dir in which it appears shadowing any others,
+        as it does for Django.
+        """
+        self._paths = {}
+        for template_dir in template_dirs():
+            for directory, _, filenames in os.walk(template_dir):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    name = os.path.relpath(path, template_dir).replace(os.sep, "/")
+                    self._paths.setdefault(name, path)
+
+    def exists(self, name):
+        return name in self._paths
+
+    def get_template(self, name):
+        try:
+            path = self._paths[name]
+        except KeyError:
+            raise TemplateDoesNotExist(name)
+
+        mtime = os.stat(path).st_mtime_ns
+        try:
+            compiled_mtime, template = self._compiled[name]
+            if compiled_mtime == mtime:
+                self.hits += 1
+                return template
+        except KeyError:
+            pass
+
+        self.misses += 1
+        backend = engines['django']
+        with open(path, "r", encoding=backend.engine.file_charset) as f:
+            source = f.read()
+        template = BackendTemplate(
+            Template(source, origin=Origin(path, template_name=name), engine=backend.engine), backend)
+        self._compiled[name] = mtime, template
+        return template
+
+    def page_template(self, page_name, template_name):
+        """
+        The template specific to page_name, if there is one, otherwise template_name.
+        """
+        page_specific_name = "page_specific/%s" % page_name
+        if self.exists(page_specific_name):
+            return self.get_template(page_specific_name)
+        return self.get_template(template_name)
+
+    def stats(self):
+        return {"templates": len(self._paths), "compiled": len(self._compiled), "hits": self.hits,
+                "misses": self.misses}
+
+
+def template_registry():
+    """
+    The TemplateRegistry shared by every Page in this process.
+    """
+    try:
+        return _registries['django']
+    except KeyError:
+        registry = _registries['django'] = TemplateRegistry()
+        return registry
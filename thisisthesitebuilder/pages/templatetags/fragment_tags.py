@@ -0,0 +1,15 @@
+from django import template
+from thisisthesitebuilder.pages.fragments import render_fragment as render_cached_fragment
+
+register = template.Library()
+
+
+@register.simple_tag()
+def render_fragment(template_name, **context):
+    """
+    {% render_fragment "shared/experience-card.html" experience=experience thumb_width=200 %}
+
+    Renders the template with just the given context, reusing the result wherever the same template is
+    rendered with the same (by fingerprint) context.
+    """
+    return render_cached_fragment(template_name, context)
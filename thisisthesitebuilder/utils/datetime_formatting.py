@@ -1,9 +1,25 @@
+from functools import lru_cache
+
+import maya
+
+
+@lru_cache(maxsize=None)
+def epoch_of(timestamp):
+    """
+    Parses an ISO-ish date or datetime string to an integer epoch; each distinct string is only parsed once.
+    """
+    return maya.parse(timestamp).epoch
 
 
 def month_day_maybe_year(maya_dt1, maya_dt2):
-    if maya_dt2.epoch - maya_dt1.epoch > 60 * 60 * 24 * 7 * 45: # More than 40 weeks
+    return _month_day_maybe_year(maya_dt1.epoch, maya_dt2.epoch)
+
+
+@lru_cache(maxsize=None)
+def _month_day_maybe_year(epoch1, epoch2):
+    if epoch2 - epoch1 > 60 * 60 * 24 * 7 * 45: # More than 40 weeks
         format = "%b %d %Y"
     else:
         format = "%b %d"
 
-    return maya_dt1.datetime(to_timezone="America/New_York").strftime(format)
\ No newline at end of file
+    return maya.MayaDT(epoch1).datetime(to_timezone="America/New_York").strftime(format)
@@ -0,0 +1,133 @@
+import hashlib
+import os
+from functools import lru_cache
+
+from thisisthesitebuilder.utils.datetime_formatting import epoch_of
+
+# Authored directories holding one file per day (or, for summaries, per month), named for that day.
+# Anything reading a span of time depends on every such file in the span, including ones added later.
+DAY_FILE_DIRS = ('images', 'clips', 'locations')
+MONTH_FILE_DIRS = ('daily-log-summaries',)
+
+ONE_DAY = 60 * 60 * 24
+
+
+def authored_path(data_dir, filename):
+    """
+    filename relative to the authored directory, the way FileChanges reports it.
+    """
+    return os.path.relpath(os.path.abspath(filename), os.path.abspath("%s/authored" % data_dir))
+
+
+@lru_cache(maxsize=None)
+def epochs_covered_by(path):
+    """
+    For a day or month file (relative to authored/), the span of epochs it covers - padded by a day either
+    side, so that no UTC offset can put a timestamp outside it.  None for any other file.
+    """
+    directory, _, filename = path.partition('/')
+    period = filename.rsplit('.', 1)[0]
+    try:
+        if directory in DAY_FILE_DIRS:
+            start = epoch_of(period)
+            end = start + ONE_DAY
+        elif directory in MONTH_FILE_DIRS:
+            start = epoch_of(period + "-01")
+            end = start + 31 * ONE_DAY
+        else:
+            return None
+    except ValueError:
+        return None
+    return start - ONE_DAY, end + ONE_DAY
+
+
+class Dependencies(object):
+    """
+    What an output (an experience, a page) read to build: authored files (relative to authored/), a span of
+    time whose day files it read, the state of the templates, and anything it displays relative to the
+    time of the build (such as dates, which gain their year once they're far enough in the past).
+
+    A span's end is None for an experience that hasn't ended yet: it reads every day file from its start
+    on, however many days go by, without its span changing from one build to the next.
+
+    Once stamped with the current digests of the authored files, it also carries a digest of exactly the
+    files it read, to be recorded alongside the output and compared against on the next build.
+    """
+
+    def __init__(self, inputs=(), span=None, templates=None, displayed=()):
+        self.inputs = set(inputs)
+        self.span = tuple(span) if span else None
+        self.templates = templates
+        self.displayed = set(displayed)
+        self.digest = None
+
+    def __eq__(self, other):
+        return ((self.inputs, self.span, self.templates, self.displayed) ==
+                (other.inputs, other.span, other.templates, other.displayed))
+
+    @classmethod
+    def combine(cls, *all_dependencies, templates=None):
+        """
+        Dependencies reading (and displaying) everything that each of all_dependencies does.
+        """
+        inputs = set()
+        displayed = set()
+        starts_and_ends = []
+        for dependencies in all_dependencies:
+            inputs.update(dependencies.inputs)
+            displayed.update(dependencies.displayed)
+            if dependencies.span:
+                starts_and_ends.append(dependencies.span)
+        span = None
+        if starts_and_ends:
+            start = min(start for start, _ in starts_and_ends)
+            ends = [end for _, end in starts_and_ends]
+            span = start, None if None in ends else max(ends)
+        return cls(inputs, span, templates, displayed)
+
+    def with_inputs(self, *inputs):
+        return Dependencies(self.inputs.union(inputs), self.span, self.templates, self.displayed)
+
+    def stamp(self, digests):
+        """
+        Takes the digest of every authored file (by path relative to authored/, as get_hashes reports them)
+        and sets self.digest to a digest of those this reads - including any that are missing.  Returns self.
+        """
+        read = {path: digest for path, digest in digests.items() if self.reads(path)}
+        for path in self.inputs:
+            read.setdefault(path, None)
+        self.digest = hashlib.md5(str(sorted(read.items(), key=lambda item: item[0])).encode()).hexdigest()
+        return self
+
+    def to_json(self):
+        return {"inputs": sorted(self.inputs), "span": self.span, "templates": self.templates,
+                "displayed": sorted(self.displayed), "digest": self.digest}
+
+    @classmethod
+    def from_json(cls, dependencies_json):
+        return cls(dependencies_json['inputs'], dependencies_json['span'], dependencies_json['templates'],
+                   dependencies_json.get('displayed', ()))
+
+    def reads(self, path):
+        if path in self.inputs:
+            return True
+        covered = epochs_covered_by(path)
+        if covered and self.span:
+            start, end = self.span
+            return (end is None or covered[0] <= end) and start <= covered[1]
+        return False
+
+    def needs_rebuild(self, previous_json):
+        """
+        Takes the Dependencies recorded (as JSON) the last time this output was successfully built.
+
+        The output needs rebuilding unless it was built from the same inputs, span and templates, displaying
+        the same build-relative things, and the files it reads are just as they were then - which is measured
+        against what the output itself recorded, so it holds however many builds have come and gone (or
+        crashed) since.  Unstamped, it always does.
+        """
+        if self.digest is None or not previous_json:
+            return True
+        if Dependencies.from_json(previous_json) != self:
+            return True
+        return previous_json.get('digest') != self.digest
@@ -1,10 +1,114 @@
-from checksumdir import dirhash
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+from thisisthesitebuilder.utils.hashing import HashCache, file_hash
+
+FileChanges = namedtuple('FileChanges', ('added', 'changed', 'removed'))
+
+
+def write_atomically(filename, content):
+    """
+    Writes content to filename such that no other process (say, another page worker) ever reads it half-written.
+    """
+    temporary_filename = "%s.%s.tmp" % (filename, os.getpid())
+    with open(temporary_filename, "w") as f:
+        f.write(content)
+    os.replace(temporary_filename, filename)
+
+
+def mark_used(filename):
+    """
+    Bumps filename's mtime, so that prune_unused knows a cache entry was used in this build - by whichever
+    process used it.
+    """
+    try:
+        os.utime(filename)
+    except FileNotFoundError:
+        pass
+
+
+def prune_unused(directory, since):
+    """
+    Deletes every file in directory not written or marked used since the epoch since (say, the start of the
+    build), returning how many.
+    """
+    pruned = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < since:
+                    try:
+                        os.remove(entry.path)
+                        pruned += 1
+                    except FileNotFoundError:
+                        pass
+    except FileNotFoundError:
+        pass
+    return pruned
+
+
+def scan_files(root):
+    """
+    Yields the path and stat of every file beneath root.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from scan_files(entry.path)
+            elif entry.is_file():
+                yield entry.path, entry.stat()
+
+
+def get_hashes(DATA_DIR, max_workers=None):
+    """
+    Hashes the authored data, using a manifest of (path, size, mtime, inode, hash) from the last build so
+    that only files whose stat has changed are read, and those in a pool of threads.
+
+    Returns the aggregate data hash, the hash of every file, and the added, changed and removed files (all
+    relative to authored/).  Changes are only since the last call; anything that needs to know what changed
+    since *it* last ran (like a page) should compare digests against its own record instead.
+    """
+    authored_dir = os.path.abspath("{}/authored".format(DATA_DIR))
+    manifest = HashCache("{}/compiled/authored_manifest.json".format(DATA_DIR))
+    previous_digests = manifest.digests()
+
+    current_digests = {}
+    stale = []
+    for path, stat in scan_files(authored_dir):
+        digest = manifest.lookup(path, stat)
+        if digest is None:
+            stale.append((path, stat))
+        else:
+            current_digests[path] = digest
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        for (path, stat), digest in zip(stale, executor.map(file_hash, [path for path, _ in stale])):
+            manifest.store(path, digest, stat)
+            current_digests[path] = digest
+
+    manifest.prune(current_digests)
+    manifest.save()
+
+    def relative(path):
+        return os.path.relpath(path, authored_dir)
+
+    changes = FileChanges(
+        added={relative(path) for path in current_digests if path not in previous_digests},
+        changed={relative(path) for path, digest in current_digests.items()
+                 if path in previous_digests and previous_digests[path] != digest},
+        removed={relative(path) for path in previous_digests if path not in current_digests},
+    )
+
+    data_hash = hashlib.md5()
+    for path, digest in sorted((relative(path), digest) for path, digest in current_digests.items()):
+        data_hash.update("{}\0{}\n".format(path, digest).encode())
 
-def get_hashes(DATA_DIR):
-    data_hash = dirhash("{}/authored".format(DATA_DIR), 'md5')
     # app_hash = dirhash(PYTHON_APP_DIR, 'md5')
-    hashes = {"data": data_hash}
+    hashes = {"data": data_hash.hexdigest(),
+              "digests": {relative(path): digest for path, digest in current_digests.items()},
+              "changes": changes}
               # "app": app_hash}
 
-    return hashes
\ No newline at end of file
+    return hashes
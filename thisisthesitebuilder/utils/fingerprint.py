@@ -0,0 +1,73 @@
+import datetime
+import hashlib
+import inspect
+import uuid
+from collections.abc import Iterable, Iterator
+
+import maya
+
+from thisisthesitebuilder.utils.hashing import HASH_LENGTH
+
+
+def fingerprint_of(value, _seen=None):
+    """
+    A stable hash of value's content, for deciding whether anything rendered from it can have changed.
+
+    Objects with a fingerprint() method (Eras, Experiences, Multimedia, Locations, Places, Pages, media
+    collections) supply their own, usually cached.  Containers are fingerprinted by their contents, sets
+    and dict keys irrespective of order, and other iterables (dict views, ranges) by what they yield.
+
+    Bound methods are fingerprinted by their name and the object they're bound to; functions and classes
+    by their name.  A one-shot iterator (a generator, say) can't be looked into without using it up, so
+    it gets a fingerprint all its own, and whatever shows it is always rendered.  Other objects are
+    fingerprinted by their attributes - never by their str(), which needn't reflect their content - or,
+    lacking any, by their repr() if their class defines one.  Anything else raises TypeError rather than
+    risk a page being skipped when it shouldn't be.
+    """
+    if value is None or isinstance(value, (str, bytes, bool, int, float)):
+        token = repr(value)
+    elif isinstance(value, maya.MayaDT):
+        token = "MayaDT:{}".format(value.iso8601())
+    elif isinstance(value, (datetime.date, datetime.time)):
+        token = "{}:{}".format(type(value).__name__, value.isoformat())
+    elif hasattr(value, 'fingerprint'):
+        token = value.fingerprint()
+    elif inspect.ismethod(value):
+        token = "method:{}:{}".format(value.__qualname__, fingerprint_of(value.__self__, _seen))
+    elif inspect.isclass(value) or inspect.isroutine(value):
+        token = "{}:{}.{}".format(type(value).__qualname__, getattr(value, '__module__', None),
+                                  getattr(value, '__qualname__', value.__name__))
+    elif isinstance(value, Iterator):
+        token = "iterator:{}".format(uuid.uuid4())
+    else:
+        _seen = _seen or set()
+        if id(value) in _seen:
+            # Something that contains itself; the first time round has already accounted for it.
+            return type(value).__qualname__
+        _seen = _seen | {id(value)}
+
+        if isinstance(value, dict):
+            token = sorted((fingerprint_of(k, _seen), fingerprint_of(v, _seen)) for k, v in value.items())
+        elif isinstance(value, (set, frozenset)):
+            token = sorted(fingerprint_of(item, _seen) for item in value)
+        elif isinstance(value, (list, tuple)):
+            token = [fingerprint_of(item, _seen) for item in value]
+        elif isinstance(value, Iterable) and not hasattr(value, '__dict__'):
+            token = [fingerprint_of(item, _seen) for item in value]
+        elif hasattr(value, '__dict__'):
+            token = fingerprint_of(vars(value), _seen)
+        elif type(value).__repr__ is not object.__repr__:
+            token = repr(value)
+        else:
+            raise TypeError("Can't fingerprint {!r}; give {} a fingerprint() method.".format(
+                value, type(value).__qualname__))
+        token = "{}:{}".format(type(value).__qualname__, token)
+
+    return hashlib.blake2b(str(token).encode(), digest_size=HASH_LENGTH // 2).hexdigest()
+
+
+def combined_fingerprint(*values):
+    """
+    One fingerprint for several values, in order.
+    """
+    return fingerprint_of(list(values))
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import mmap
+import os
+
+# Hex digits in a content hash.  Media ingested before full-file hashing carry 8-digit MD5s of a
+# slice of the file instead; see legacy_checksum.
+HASH_LENGTH = 16
+LEGACY_HASH_LENGTH = 8
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(filename):
+    """
+    BLAKE2b of the entire file, streamed through an mmap so large videos are never read into memory at once.
+    """
+    digest = hashlib.blake2b(digest_size=HASH_LENGTH // 2)
+    with open(filename, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            return digest.hexdigest()
+        with mapped, memoryview(mapped) as view:
+            for offset in range(0, len(view), CHUNK_SIZE):
+                digest.update(view[offset:offset + CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def legacy_checksum(filename, offset=0, length=1024):
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        return hashlib.md5(f.read(length)).hexdigest()[:LEGACY_HASH_LENGTH]
+
+
+class HashCache(object):
+    """
+    On-disk cache of file hashes, keyed by absolute path and invalidated by size, mtime and inode.
+
+    Only files that are new or have changed since they were last seen are hashed again.
+    """
+
+    def __init__(self, cache_filename):
+        self.cache_filename = cache_filename
+        self._dirty = False
+        try:
+            with open(cache_filename, "r") as f:
+                self._entries = json.loads(f.read())
+        except FileNotFoundError:
+            self._entries = {}
+        except json.JSONDecodeError:
+            print("*** {} is unreadable; every file will be hashed again.".format(cache_filename))
+            self._entries = {}
+
+    @classmethod
+    def for_data_dir(cls, data_dir):
+        return cls("%s/compiled/hash_cache.json" % data_dir)
+
+    @staticmethod
+    def stamp(stat):
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def lookup(self, filename, stat=None):
+        """
+        Returns the cached hash of filename if it hasn't changed since it was hashed, otherwise None.
+
+        Pass stat if you already have it (say, from os.scandir) to save stat-ing the file again.
+        """
+        path = os.path.abspath(filename)
+        entry = self._entries.get(path)
+        if entry and entry[:3] == self.stamp(stat or os.stat(path)):
+            return entry[3]
+
+    def store(self, filename, digest, stat=None):
+        path = os.path.abspath(filename)
+        self._entries[path] = self.stamp(stat or os.stat(path)) + [digest]
+        self._dirty = True
+
+    def digests(self):
+        """
+        Every cached path and its hash, as of when it was cached.
+        """
+        return {path: entry[3] for path, entry in self._entries.items()}
+
+    def prune(self, paths_to_keep):
+        for path in set(self._entries) - set(paths_to_keep):
+            del self._entries[path]
+            self._dirty = True
+
+    def hash(self, filename):
+        digest = self.lookup(filename)
+        if digest is None:
+            digest = file_hash(filename)
+            self.store(filename, digest)
+        return digest
+
+    def save(self):
+        # file_utils imports this module, so this can't be imported at the top.
+        from thisisthesitebuilder.utils.file_utils import write_atomically
+
+        if not self._dirty:
+            return
+        write_atomically(self.cache_filename, json.dumps(self._entries))
+        self._dirty = False
@@ -0,0 +1,77 @@
+import bisect
+
+
+class Timeline(object):
+    """
+    Values ordered by epoch, so that "everything between start and end" is a pair of binary searches.
+    """
+
+    def __init__(self, epochs_and_values=()):
+        entries = sorted(epochs_and_values, key=lambda entry: entry[0])
+        self.epochs = [epoch for epoch, _ in entries]
+        self.values = [value for _, value in entries]
+
+    def __len__(self):
+        return len(self.values)
+
+    def between(self, start, end, inclusive=True):
+        """
+        Values from start to end, in time order.  Endpoints are included unless inclusive is False.
+        """
+        if inclusive:
+            first = bisect.bisect_left(self.epochs, start)
+            last = bisect.bisect_right(self.epochs, end)
+        else:
+            first = bisect.bisect_right(self.epochs, start)
+            last = bisect.bisect_left(self.epochs, end)
+        return self.values[first:last]
+
+
+class IntervalIndex(object):
+    """
+    A static interval tree: intervals sorted by start, with the latest end of every subtree alongside.
+
+    overlapping() skips any subtree that ends too early or starts too late, so it costs
+    O(log n + k) and returns the k matches already sorted by start.
+    """
+
+    def __init__(self, starts_ends_and_values=()):
+        entries = sorted(starts_ends_and_values, key=lambda entry: entry[0])
+        self.starts = [start for start, _, _ in entries]
+        self.ends = [end for _, end, _ in entries]
+        self.values = [value for _, _, value in entries]
+        self._max_ends = list(self.ends)
+        self._build(0, len(entries))
+
+    def __len__(self):
+        return len(self.values)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for child_max_end in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child_max_end is not None and child_max_end > self._max_ends[mid]:
+                self._max_ends[mid] = child_max_end
+        return self._max_ends[mid]
+
+    def overlapping(self, start, end):
+        """
+        Values whose interval overlaps (start, end) at all - including those that contain it entirely - by start.
+        """
+        found = []
+        self._collect(0, len(self.values), start, end, found)
+        return found
+
+    def _collect(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_ends[mid] <= start:
+            # Nothing in this subtree ends after our start.
+            return
+        self._collect(lo, mid, start, end, found)
+        if self.starts[mid] < end:
+            if self.ends[mid] > start:
+                found.append(self.values[mid])
+            self._collect(mid + 1, hi, start, end, found)
@@ -1,11 +1,37 @@
+import hashlib
+import os
+import pickle
 import yaml
 from collections import OrderedDict
 
 from thisisthesitebuilder.pages.parsers import parse_markdown_and_django_template
+from thisisthesitebuilder.utils.file_utils import mark_used, prune_unused
 
+# libyaml's parser when PyYAML was built with it; the pure-Python one otherwise.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
-def yaml_ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
-    class OrderedLoader(Loader):
+
+def _construct_ordered_mapping(loader, node):
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node))
+
+
+class OrderedSafeLoader(SafeLoader):
+    pass
+
+
+OrderedSafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_ordered_mapping)
+
+
+def yaml_load(stream):
+    return yaml.load(stream, SafeLoader)
+
+
+def yaml_ordered_load(stream, Loader=None, object_pairs_hook=OrderedDict):
+    if Loader is None and object_pairs_hook is OrderedDict:
+        return yaml.load(stream, OrderedSafeLoader)
+
+    class OrderedLoader(Loader or SafeLoader):
         pass
     def construct_mapping(loader, node):
         loader.flatten_mapping(node)
@@ -16,6 +42,58 @@ def yaml_ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict)
     return yaml.load(stream, OrderedLoader)
 
 
+def load_yaml_file(filename, ordered=False, cache_dir=None):
+    """
+    Parses a YAML file, keeping mapping order if asked.
+
+    With a cache_dir, the parsed document is pickled there, keyed by path and checked against size and
+    mtime, so an unchanged file is never parsed again.  Every file gets its own cache entry, which keeps
+    the cache safe to use from worker processes.
+    """
+    load = yaml_ordered_load if ordered else yaml_load
+
+    if not cache_dir:
+        with open(filename, 'r') as f:
+            return load(f.read())
+
+    stat = os.stat(filename)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cache_key = hashlib.blake2b("{}:{}".format(os.path.abspath(filename), ordered).encode(), digest_size=16)
+    cache_filename = "{}/{}.pickle".format(cache_dir, cache_key.hexdigest())
+
+    try:
+        with open(cache_filename, 'rb') as f:
+            cached_stamp, document = pickle.load(f)
+        if cached_stamp == stamp:
+            mark_used(cache_filename)
+            return document
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    with open(filename, 'r') as f:
+        document = load(f.read())
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_filename = "{}.{}.tmp".format(cache_filename, os.getpid())
+    with open(temporary_filename, 'wb') as f:
+        pickle.dump((stamp, document), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_filename, cache_filename)
+
+    return document
+
+
+def yaml_cache_dir(data_dir):
+    return "%s/compiled/yaml" % data_dir
+
+
+def prune_yaml_cache(data_dir, since):
+    """
+    Deletes the cached parse of every YAML file not loaded since the epoch since - renamed and deleted
+    files among them, whose entries would otherwise be kept forever.
+    """
+    return prune_unused(yaml_cache_dir(data_dir), since)
+
+
 def md_field_from_file(data_dir, subdir, content_filename, suffix):
     try:
         content_full_path = (
@@ -25,4 +103,4 @@ def md_field_from_file(data_dir, subdir, content_filename, suffix):
     except FileNotFoundError:
         return
 
-    return parse_markdown_and_django_template(content)
\ No newline at end of file
+    return parse_markdown_and_django_template(content)
@@ -1,9 +1,9 @@
 import os
 from collections import OrderedDict
 
-import yaml
 from thisisthebus.settings.constants import DATA_DIR
 
+from thisisthesitebuilder.utils.yaml_loader import load_yaml_file, yaml_cache_dir
 from thisisthesitebuilder.where.models import Place, Location
 
 PLACES_DIR = "%s/authored/places" % DATA_DIR
@@ -20,18 +20,16 @@ def process_locations(places):
         location_filename = "%s/%s" % (locations_dir, location_file)
         day = location_file.rstrip(".yaml")
         locations_for_day = {}
-        with open(location_filename, 'r') as f:
-            location_bytes = f.read()
-            location_yaml = yaml.load(location_bytes)
-            for time, location_meta in location_yaml.items():
-                try:
-                    location = Location(day, time, places[location_meta])
-                except TypeError:
-                    place = places[location_meta[0]]
-                    significance = location_meta[1]
-                    location = Location(day, time, place, significance)
-
-                locations_for_day[time] = location
+        location_yaml = load_yaml_file(location_filename, cache_dir=yaml_cache_dir(DATA_DIR))
+        for time, location_meta in location_yaml.items():
+            try:
+                location = Location(day, time, places[location_meta])
+            except TypeError:
+                place = places[location_meta[0]]
+                significance = location_meta[1]
+                location = Location(day, time, place, significance)
+
+            locations_for_day[time] = location
         locations[day] = OrderedDict(sorted(locations_for_day.items(), key=lambda l: str(l)))
 
     for place_slug, place in places.items():
@@ -7,6 +7,7 @@ import yaml
 from thisisthebus.settings.constants import DATA_DIR
 
 from thisisthesitebuilder.utils.questions import what_time, which_day
+from thisisthesitebuilder.utils.yaml_loader import yaml_load
 from thisisthesitebuilder.where.build import process_places
 
 
@@ -43,7 +44,7 @@ def new_location():
 
     try:
         with open(day_yaml_filename, 'r') as f:
-            day_locations = yaml.load(f)
+            day_locations = yaml_load(f)
     except FileNotFoundError:
         day_locations = {}
 
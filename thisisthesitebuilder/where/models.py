@@ -4,11 +4,14 @@ import hashlib
 import json
 
 import requests
-import yaml
 from thisisthebus.settings.constants import DATA_DIR, FRONTEND_APPS_DIR
 
 from thisisthebus.settings.secrets import MAPBOX_ACCESS_KEY
 
+from thisisthesitebuilder.utils.datetime_formatting import epoch_of
+from thisisthesitebuilder.utils.fingerprint import combined_fingerprint
+from thisisthesitebuilder.utils.yaml_loader import load_yaml_file, yaml_cache_dir
+
 
 class Place(object):
 
@@ -43,11 +46,22 @@ class Place(object):
     def __str__(self):
         return "{} - {}".format(self.small_name, self.big_name)
 
+    def fingerprint(self):
+        """
+        The authored YAML already hashes everything about a Place, bar where its thumb ended up.
+        """
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = combined_fingerprint(self.slug, self.yaml_checksum,
+                                                     getattr(self, 'thumb_filename', None))
+            return self._fingerprint
+
     @staticmethod
     def from_yaml(slug):
-        with open("%s/authored/places/%s" % (DATA_DIR, slug), "r") as f:
-            authored_place = yaml.load(f)
-            f.seek(0)
+        place_filename = "%s/authored/places/%s" % (DATA_DIR, slug)
+        authored_place = load_yaml_file(place_filename, cache_dir=yaml_cache_dir(DATA_DIR))
+        with open(place_filename, "r") as f:
             checksum = hashlib.md5(bytes(f.read(), encoding='utf-8')).hexdigest()
 
         place = Place(yaml_checksum=checksum, slug=slug, **authored_place)
@@ -132,6 +146,11 @@ class Location(object):
         self.day = day
         self.time = time
 
+        try:
+            self._epoch = epoch_of(day + "T" + time)
+        except TypeError:
+            raise TypeError("Had trouble parsing date or time in {} {}".format(day, time))
+
         self.place = place
 
         self._significance = significance
@@ -142,6 +161,16 @@ class Location(object):
     def __str__(self):
         return ("{}T{}: {}".format(self.day, self.time, self.place))
 
+    def epoch(self):
+        return self._epoch
+
+    def fingerprint(self):
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = combined_fingerprint(self.day, self.time, self._significance, self.place)
+            return self._fingerprint
+
     def significance(self):
         if self._significance is None:
             return self.place.significance